@@ -0,0 +1,198 @@
+"""
+balanced_scheduler.py
+
+Defines BalancedScheduler class for deciding which year scrape_oshiete.py
+should request pages for next when running in balanced mode.
+
+corpus-compiler.py trims each category down to the number of words
+available for the year with the fewest words in that category, so words
+scraped for a category in which a year is already ahead are wasted. The
+scheduler keeps running totals of the number of words in each category for
+each year, and chooses the year for which the next request is expected to
+add the most words to the balanced corpus.
+
+The expected number of usable words per request for a year is:
+
+hit_rate * sum(share[c] * min(mean_words[c], deficit[c]) for each category c)
+
+hit_rate
+    the proportion of recently requested IDs for the year that had content
+    from the year
+share[c], mean_words[c]
+    the proportion of recent pages for the year that were in category c,
+    and their mean word count
+deficit[c]
+    how many words the year is behind the other years in category c (zero
+    if it is not behind)
+
+Word totals are taken from the word counts in the log. For pages logged
+before word counts were added to the log, the saved files are counted once
+and the results are cached in WORD_COUNTS_FILE_NAME in the corpus folder.
+The cache is saved every COUNT_SAVE_INTERVAL files and when counting is
+interrupted, so counting carries on where it left off the next time.
+"""
+
+import json
+import os
+from collections import deque
+
+from helper.file_helper import document_exists, save_text_to_file
+from helper.text_helper import jp_word_count
+
+EXCLUDE_CATEGORIES = ['gooサービス', '公式アカウントからの質問']
+WORD_COUNTS_FILE_NAME = 'word_counts.json'
+# Number of recent pages and requests used to estimate the category mix and
+# hit rate for each year
+RECENT_PAGES = 1000
+RECENT_REQUESTS = 2000
+# Number of files counted between saves of the word count cache
+COUNT_SAVE_INTERVAL = 1000
+
+
+class BalancedScheduler:
+    """
+    A class to keep track of the number of words in each category for each
+    year and choose which year to scrape next
+
+    Attributes
+    ----------
+
+    years: list
+        the years being scraped, as strings
+    word_counts: dict
+        word_counts[year][category] is the total number of words in the
+        corpus for the category for the year
+    recent_pages: dict
+        recent_pages[year] holds a tuple (category, word_count) for each of
+        the most recently saved pages for the year
+    recent_requests: dict
+        recent_requests[year] holds whether each of the most recent
+        requests for the year had content from the year
+    """
+
+    def __init__(self, years: list, log_rows: list, corpus_path: str):
+        """
+        Get word totals from the log.
+
+        Parameters
+        ----------
+        years: list
+            The years to be scraped, as strings
+        log_rows: list
+            The rows of the log, with the format
+            [file_name, url, category, year, word_count]. Rows without a
+            word count are counted from the saved file.
+        corpus_path: str
+            The path to the corpus folder
+        """
+
+        self.years = years
+        self.word_counts = {year: {} for year in years}
+        self.recent_pages = {year: deque(maxlen=RECENT_PAGES)
+                             for year in years}
+        self.recent_requests = {year: deque(maxlen=RECENT_REQUESTS)
+                                for year in years}
+
+        counts_path = os.path.join(corpus_path, WORD_COUNTS_FILE_NAME)
+        if os.path.isfile(counts_path):
+            with open(counts_path, encoding='utf-8') as f:
+                cached_counts = json.load(f)
+        else:
+            cached_counts = {}
+        num_saved = len(cached_counts)
+
+        try:
+            for row in log_rows:
+                file_name, _, category, year = row[:4]
+                if year not in self.word_counts:
+                    continue
+                if len(row) > 4 and row[4]:
+                    word_count = int(row[4])
+                elif file_name in cached_counts:
+                    word_count = cached_counts[file_name]
+                else:
+                    file_path = os.path.join(corpus_path, year, category,
+                                             file_name)
+                    if not document_exists(file_path):
+                        continue
+                    word_count = jp_word_count(file_path)
+                    cached_counts[file_name] = word_count
+                    if len(cached_counts) - num_saved >= COUNT_SAVE_INTERVAL:
+                        save_text_to_file(json.dumps(cached_counts),
+                                          counts_path)
+                        num_saved = len(cached_counts)
+                        print(f"{num_saved} files counted...")
+                self.add_page(year, category, word_count)
+        finally:
+            if len(cached_counts) > num_saved:
+                save_text_to_file(json.dumps(cached_counts), counts_path)
+
+    def add_page(self, year: str, category: str, word_count: int):
+        """Add a saved page to the word totals"""
+
+        self.word_counts[year][category] = \
+            self.word_counts[year].get(category, 0) + word_count
+        self.recent_pages[year].append((category, word_count))
+
+    def add_request(self, year: str, success: bool):
+        """Record whether a request had content from the year"""
+
+        self.recent_requests[year].append(success)
+
+    def balanced_word_count(self) -> int:
+        """Get the number of words that would be in the corpus if it were
+        compiled now"""
+
+        categories = set.intersection(
+            *[set(counts) for counts in self.word_counts.values()])
+        return sum(
+            min(self.word_counts[year][category] for year in self.years)
+            for category in categories
+            if category not in EXCLUDE_CATEGORIES
+        )
+
+    def expected_usable_words(self, year: str) -> float:
+        """Get the expected number of words added to the balanced corpus
+        by the next request for the year"""
+
+        recent_pages = self.recent_pages[year]
+        if not recent_pages:
+            # Try years with no history first to find out what they yield
+            return float('inf')
+
+        # Add one hit and one miss so that the hit rate is never zero
+        requests = self.recent_requests[year]
+        hit_rate = (sum(requests) + 1) / (len(requests) + 2)
+
+        category_word_counts = {}
+        for category, word_count in recent_pages:
+            category_word_counts.setdefault(category, []).append(word_count)
+        expected_words = 0.0
+        for category, word_counts in category_word_counts.items():
+            if category in EXCLUDE_CATEGORIES:
+                continue
+            other_year_words = min(
+                (self.word_counts[y].get(category, 0)
+                 for y in self.years if y != year),
+                default=0
+            )
+            deficit = max(
+                0, other_year_words - self.word_counts[year].get(category, 0))
+            share = len(word_counts) / len(recent_pages)
+            mean_words = sum(word_counts) / len(word_counts)
+            expected_words += share * min(mean_words, deficit)
+        return hit_rate * expected_words
+
+    def choose_year(self, years: list) -> str:
+        """Choose which of the years to scrape next, or return None if the
+        list is empty"""
+
+        if not years:
+            return None
+        scores = {year: self.expected_usable_words(year) for year in years}
+        year = max(years, key=scores.get)
+        if scores[year] == 0:
+            # No year is behind in the categories it gets pages in, so
+            # choose the year with the fewest words
+            year = min(years, key=lambda y: sum(self.word_counts[y].values()))
+        return year
@@ -0,0 +1,276 @@
+"""
+compress_corpus.py
+
+Compress the documents in the corpus using a zstd dictionary trained on a
+sample of the corpus, and pack them into a single file for each category
+for each year.
+
+Most documents are smaller than a disk block (usually 4 KiB), and each file
+takes up at least one block however small it is, so millions of documents
+stored as separate files take up several times more disk space than the
+text in them. Compressing the files in place does not help with this, and
+reading many small files is limited by the number of files opened rather
+than the number of bytes read. Packing the documents in each category
+folder into one file avoids both problems.
+
+Documents are short, so compressing each one on its own (e.g. with gzip)
+does not make them much smaller, because there is not enough text in a
+single document for the compressor to learn from. A dictionary trained on a
+sample of the corpus gives the compressor the common vocabulary and phrasing
+of the whole corpus to work with. Each document is still compressed on its
+own, so any document can be read without reading the rest of the pack.
+
+Packed documents keep their paths, so the log, the duplicates database etc.
+are not affected. All the functions in the toolkit that list and read
+documents find packed documents automatically (see helper/file_helper.py).
+The zstandard package is required to read packed or compressed documents.
+
+New documents saved by scrape_oshiete.py once a dictionary has been trained
+are saved as separate files, compressed at a low level so that scraping is
+not slowed down. Pages updated by scrape_oshiete.py --refresh are also saved
+as separate files, which take precedence over packed documents with the same
+name. Run pack again from time to time to add these files to the packs.
+Do not run pack or unpack while scraping.
+
+Usage:
+
+Train the dictionary (saved to CORPUS_PATH/documents.zdict):
+> python compress_corpus.py train
+
+Pack all documents saved as files, compressing them at a high level:
+> python compress_corpus.py pack
+
+Save all documents as uncompressed files again and delete the packs (e.g.
+before training a new dictionary):
+> python compress_corpus.py unpack
+
+Print the disk footprint and cold-cache read throughput of the corpus (run
+before and after packing to compare):
+> python compress_corpus.py benchmark
+
+The disk footprint is given as both the total size of the files and the
+space allocated to them on disk, which is larger because each file takes up
+at least one block. Cold-cache read throughput is measured by reading a random
+sample of documents after asking the operating system to drop them from its
+cache. This is only possible on systems that support posix_fadvise (e.g.
+Linux). On other systems the sample will be read from the cache if the
+documents have been read recently, and a warning is printed.
+"""
+
+import argparse
+import os
+import random
+import time
+from os.path import isfile
+from os.path import join as joinpath
+
+import zstandard
+
+from helper.file_helper import (ZSTD_DICT_FILE_NAME, get_files_and_folders,
+                                get_storage_path, get_text_from_file,
+                                is_compressed_file, is_pack_file,
+                                iter_document_paths, load_pack_index,
+                                pack_folder, save_text_to_file, unpack_folder)
+
+CORPUS_PATH = "E:/oshiete_corpus/"
+ZSTD_DICT_PATH = joinpath(CORPUS_PATH, ZSTD_DICT_FILE_NAME)
+TEMP_FILE_PATH = joinpath(CORPUS_PATH, 'decompress.tmp')
+YEARS = ['2001', '2021']
+DICT_SIZE = 112640
+TRAINING_SAMPLE_SIZE = 10000
+BENCHMARK_SAMPLE_SIZE = 5000
+# Used for the allocated size on systems that do not report it
+BLOCK_SIZE = 4096
+
+
+# ====================
+def get_args():
+    """Get command-line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description='Compress and pack the documents in the corpus',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('command',
+                        choices=['train', 'pack', 'unpack', 'benchmark'],
+                        help='See the module documentation')
+    return parser.parse_args()
+
+
+# ====================
+def iter_category_folders():
+    """Yield the path of each category folder for each year"""
+
+    for year in YEARS:
+        _, category_folders = get_files_and_folders(
+            joinpath(CORPUS_PATH, year))
+        yield from category_folders
+
+
+# ====================
+def train_dictionary():
+    """Train a zstd dictionary on a random sample of documents"""
+
+    if isfile(ZSTD_DICT_PATH):
+        print(f'{ZSTD_DICT_PATH} already exists. Documents compressed with',
+              'it could not be read if it were replaced, so unpack all',
+              'documents and delete it first to train a new dictionary.')
+        return
+    document_paths = list(iter_document_paths(CORPUS_PATH, YEARS))
+    sample = random.sample(document_paths,
+                           min(TRAINING_SAMPLE_SIZE, len(document_paths)))
+    samples = [get_text_from_file(path).encode('utf-8') for path in sample]
+    print(f'Training dictionary on {len(samples)} documents...')
+    zstd_dict = zstandard.train_dictionary(DICT_SIZE, samples)
+    with open(ZSTD_DICT_PATH, 'wb') as f:
+        f.write(zstd_dict.as_bytes())
+    print(f'Dictionary saved to {ZSTD_DICT_PATH}.')
+
+
+# ====================
+def pack():
+    """Pack all documents saved as files into the pack for their folder"""
+
+    if not isfile(ZSTD_DICT_PATH):
+        print('No dictionary found. Run "python compress_corpus.py train"',
+              'first.')
+        return
+    footprint_before = get_disk_footprint()
+    num_packed = 0
+    for folder in iter_category_folders():
+        num_packed += pack_folder(folder, ZSTD_DICT_PATH)
+        print(f'{folder}: packed')
+    print(f'Packed {num_packed} documents.')
+    print_disk_footprint('Before', footprint_before)
+    print_disk_footprint('After', get_disk_footprint())
+
+
+# ====================
+def unpack():
+    """Save all packed documents as files and decompress all compressed
+    files"""
+
+    footprint_before = get_disk_footprint()
+    num_unpacked = 0
+    for folder in iter_category_folders():
+        num_unpacked += unpack_folder(folder)
+    num_decompressed = 0
+    for path in iter_document_paths(CORPUS_PATH, YEARS):
+        if not is_compressed_file(path):
+            continue
+        # Write to a temporary file first so that the document is not lost
+        # if the program is terminated
+        save_text_to_file(get_text_from_file(path), TEMP_FILE_PATH)
+        os.replace(TEMP_FILE_PATH, path)
+        num_decompressed += 1
+    print(f'Unpacked {num_unpacked} documents and decompressed',
+          f'{num_decompressed} documents.')
+    print_disk_footprint('Before', footprint_before)
+    print_disk_footprint('After', get_disk_footprint())
+
+
+# ====================
+def get_disk_footprint() -> dict:
+    """Get the number of documents and the total file size and allocated
+    size for documents stored as uncompressed files, as compressed files and
+    in packs"""
+
+    footprint = {
+        storage: {'documents': 0, 'size': 0, 'allocated': 0}
+        for storage in ['uncompressed', 'compressed', 'packed']
+    }
+    for folder in iter_category_folders():
+        file_names = set()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if is_pack_file(entry.name):
+                    totals = footprint['packed']
+                else:
+                    file_names.add(entry.name)
+                    totals = footprint['compressed'
+                                       if is_compressed_file(entry.path)
+                                       else 'uncompressed']
+                    totals['documents'] += 1
+                stat = entry.stat()
+                totals['size'] += stat.st_size
+                if hasattr(stat, 'st_blocks'):
+                    totals['allocated'] += stat.st_blocks * 512
+                else:
+                    totals['allocated'] += \
+                        -(-stat.st_size // BLOCK_SIZE) * BLOCK_SIZE
+        # Files take precedence over packed documents with the same name
+        _, packed_documents = load_pack_index(folder)
+        footprint['packed']['documents'] += \
+            len(packed_documents.keys() - file_names)
+    return footprint
+
+
+# ====================
+def print_disk_footprint(label: str, footprint: dict):
+
+    for storage, totals in footprint.items():
+        if totals['size']:
+            print(f'{label}: {totals["documents"]} {storage} documents,',
+                  f'{totals["size"] / 1_000_000:.1f} MB',
+                  f'({totals["allocated"] / 1_000_000:.1f} MB on disk)')
+
+
+# ====================
+def drop_from_cache(file_path: str) -> bool:
+    """Ask the operating system to drop a file from its cache
+
+    Return False if this is not supported"""
+
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+# ====================
+def benchmark():
+    """Print the disk footprint of the corpus and the cold-cache read
+    throughput for a random sample of documents"""
+
+    print_disk_footprint('Disk footprint', get_disk_footprint())
+
+    document_paths = list(iter_document_paths(CORPUS_PATH, YEARS))
+    sample = random.sample(document_paths,
+                           min(BENCHMARK_SAMPLE_SIZE, len(document_paths)))
+    storage_paths = {get_storage_path(path) for path in sample}
+    cold_cache = all([drop_from_cache(path) for path in storage_paths])
+    if not cold_cache:
+        print('Warning: could not drop documents from the cache, so read',
+              'throughput may be for a warm cache.')
+    start_time = time.perf_counter()
+    text_bytes = sum(len(get_text_from_file(path).encode('utf-8'))
+                     for path in sample)
+    seconds = time.perf_counter() - start_time
+    print(f'Read {len(sample)} documents in {seconds:.2f} seconds:',
+          f'{len(sample) / seconds:.0f} documents/s,',
+          f'{text_bytes / seconds / 1_000_000:.1f} MB/s of text.')
+
+
+# ====================
+def main():
+
+    args = get_args()
+    if args.command == 'train':
+        train_dictionary()
+    elif args.command == 'pack':
+        pack()
+    elif args.command == 'unpack':
+        unpack()
+    else:
+        benchmark()
+
+
+# ====================
+if __name__ == "__main__":
+
+    main()
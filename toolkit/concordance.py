@@ -0,0 +1,290 @@
+"""
+concordance.py
+
+Build an inverted index of the compiled corpus and use it to get KWIC
+(key word in context) concordance lines for words and phrases.
+
+Build the index from the tokenized corpus files created by
+corpus-compiler.py (run again whenever the corpus is recompiled):
+
+> python concordance.py build
+
+Then search for a word, or a phrase with words separated by spaces as in the
+tokenized corpus files:
+
+> python concordance.py query スマホ
+> python concordance.py query "どう すれ ば" --width 5 --year 2021
+> python concordance.py query パソコン --category computing-technology
+
+Each concordance line is printed in tab-separated format as:
+left context, match, right context, corpus file, article localpath
+
+The index is saved in INDEX_PATH as NumPy arrays that are memory-mapped when
+querying, so only the parts of the index needed to answer a query are read
+from disk:
+
+tokens.npy          token ID at each position in the corpus, where
+                    positions run through all articles in all files
+postings.npy        positions of each token type, sorted by token ID and
+                    then position
+posting_starts.npy  index in postings.npy of the first position of each
+                    token ID
+article_starts.npy  position of the first token of each article
+article_files.npy   index in files.txt of the file each article is in
+vocab.txt           token type for each token ID
+files.txt           name of each corpus file
+articles.txt        localpath of each article, taken from the
+                    <article localpath=...> tags
+
+The file, article and token offset within the article for a posting are
+found from its position using article_starts.npy and article_files.npy.
+Context is never taken from outside the article containing the match.
+"""
+
+import argparse
+import time
+from os.path import basename
+from os.path import join as joinpath
+
+import numpy as np
+
+from helper.corpus_helper import (get_corpus_files, iter_articles,
+                                  parse_corpus_file_name)
+from helper.file_helper import save_text_to_file
+
+CORPUS_PATH = "E:/oshiete_corpus/"
+TOKENIZED_PATH = joinpath(CORPUS_PATH, 'tokenized')
+INDEX_PATH = joinpath(CORPUS_PATH, 'index')
+
+
+# ====================
+def get_args():
+    """Get command-line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description='Build and query a concordance index of the corpus',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build',
+                          help='Build the index from the tokenized corpus')
+    query_parser = subparsers.add_parser(
+        'query',
+        help='Print concordance lines for a word or phrase',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    query_parser.add_argument('phrase',
+                              help='The word or phrase to search for, with '
+                                   'words separated by spaces')
+    query_parser.add_argument('--width',
+                              type=int,
+                              default=10,
+                              help='Number of words of context on each side')
+    query_parser.add_argument('--year',
+                              action='append',
+                              help='Only include matches from this year '
+                                   '(can be used more than once)')
+    query_parser.add_argument('--category',
+                              action='append',
+                              help='Only include matches from this category, '
+                                   'e.g. business-career (can be used more '
+                                   'than once)')
+    query_parser.add_argument('--limit',
+                              type=int,
+                              default=100,
+                              help='Maximum number of lines to print (0 to '
+                                   'print all)')
+    return parser.parse_args()
+
+
+# ====================
+def build_index():
+    """Build the index from the tokenized corpus files and save it to
+    INDEX_PATH.
+
+    See the module documentation for details."""
+
+    start_time = time.perf_counter()
+    corpus_files = get_corpus_files(TOKENIZED_PATH)
+    token_ids = {}
+    article_tokens = []
+    article_files = []
+    article_paths = []
+    for file_index, corpus_file in enumerate(corpus_files):
+        with open(corpus_file, encoding='utf-8') as f:
+            corpus_text = f.read()
+        for localpath, article_text in iter_articles(corpus_text):
+            tokens = article_text.split()
+            article_tokens.append(np.fromiter(
+                (token_ids.setdefault(t, len(token_ids)) for t in tokens),
+                dtype=np.int32, count=len(tokens)))
+            article_files.append(file_index)
+            article_paths.append(localpath)
+        print(f'{basename(corpus_file)}: indexed')
+
+    article_lengths = [len(a) for a in article_tokens]
+    article_starts = np.zeros(len(article_tokens) + 1, dtype=np.int64)
+    np.cumsum(article_lengths, out=article_starts[1:])
+    tokens = np.concatenate(article_tokens) if article_tokens \
+        else np.zeros(0, dtype=np.int32)
+    # A stable sort keeps the positions of each token type in order
+    postings = np.argsort(tokens, kind='stable')
+    posting_starts = np.zeros(len(token_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tokens, minlength=len(token_ids)),
+              out=posting_starts[1:])
+
+    save_text_to_file('\n'.join(token_ids.keys()),
+                      joinpath(INDEX_PATH, 'vocab.txt'))
+    save_text_to_file('\n'.join(basename(f) for f in corpus_files),
+                      joinpath(INDEX_PATH, 'files.txt'))
+    save_text_to_file('\n'.join(article_paths),
+                      joinpath(INDEX_PATH, 'articles.txt'))
+    np.save(joinpath(INDEX_PATH, 'tokens.npy'), tokens)
+    np.save(joinpath(INDEX_PATH, 'postings.npy'), postings)
+    np.save(joinpath(INDEX_PATH, 'posting_starts.npy'), posting_starts)
+    np.save(joinpath(INDEX_PATH, 'article_starts.npy'), article_starts)
+    np.save(joinpath(INDEX_PATH, 'article_files.npy'),
+            np.array(article_files, dtype=np.int32))
+    print(f'Indexed {len(tokens)} tokens, {len(token_ids)} types and',
+          f'{len(article_paths)} articles in',
+          f'{time.perf_counter() - start_time:.1f} seconds.')
+    print(f'Index saved to {INDEX_PATH}.')
+
+
+# ====================
+class ConcordanceIndex:
+    """
+    A class to represent an index built by build_index, with the arrays
+    memory-mapped from disk
+
+    See the module documentation for a description of the attributes.
+    """
+
+    # ====================
+    def __init__(self, index_path: str = INDEX_PATH):
+
+        def load_lines(file_name):
+            with open(joinpath(index_path, file_name),
+                      encoding='utf-8') as f:
+                return f.read().split('\n')
+
+        def load_array(file_name):
+            return np.load(joinpath(index_path, file_name), mmap_mode='r')
+
+        self.vocab = load_lines('vocab.txt')
+        self.token_ids = {t: i for i, t in enumerate(self.vocab)}
+        self.files = load_lines('files.txt')
+        self.articles = load_lines('articles.txt')
+        self.tokens = load_array('tokens.npy')
+        self.postings = load_array('postings.npy')
+        self.posting_starts = load_array('posting_starts.npy')
+        self.article_starts = load_array('article_starts.npy')
+        self.article_files = load_array('article_files.npy')
+
+    # ====================
+    def find(self, phrase: list, years: list = None,
+             categories: list = None) -> tuple:
+        """Find all occurrences of a phrase (a list of tokens)
+
+        Return a tuple (positions, articles) of arrays with the position of
+        the first token of each match and the index of the article it is in"""
+
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        if not phrase or any(t not in self.token_ids for t in phrase):
+            return empty
+        ids = [self.token_ids[t] for t in phrase]
+
+        # Start from the least frequent token in the phrase
+        counts = [self.posting_starts[i + 1] - self.posting_starts[i]
+                  for i in ids]
+        anchor = int(np.argmin(counts))
+        anchor_id = ids[anchor]
+        positions = np.asarray(self.postings[
+            self.posting_starts[anchor_id]:self.posting_starts[anchor_id + 1]
+        ], dtype=np.int64) - anchor
+        positions = positions[positions >= 0]
+        articles = np.searchsorted(self.article_starts, positions,
+                                   side='right') - 1
+
+        # Apply year and category filters
+        if years or categories:
+            file_info = [parse_corpus_file_name(f) for f in self.files]
+            file_ok = np.array([
+                (not years or year in years)
+                and (not categories or category in categories)
+                for year, category in file_info
+            ], dtype=bool)
+            if not file_ok.any():
+                return empty
+            keep = file_ok[self.article_files[articles]]
+            positions = positions[keep]
+            articles = articles[keep]
+
+        # Keep matches that are entirely inside one article and where every
+        # token in the phrase matches
+        keep = positions + len(ids) <= self.article_starts[articles + 1]
+        positions = positions[keep]
+        articles = articles[keep]
+        for offset, token_id in enumerate(ids):
+            if offset == anchor or len(positions) == 0:
+                continue
+            keep = self.tokens[positions + offset] == token_id
+            positions = positions[keep]
+            articles = articles[keep]
+        return (positions, articles)
+
+    # ====================
+    def kwic_line(self, position: int, article: int, phrase_len: int,
+                  width: int) -> str:
+        """Get a tab-separated concordance line for a match"""
+
+        article_start = self.article_starts[article]
+        article_end = self.article_starts[article + 1]
+        end = position + phrase_len
+        left = self.tokens[max(article_start, position - width):position]
+        match = self.tokens[position:end]
+        right = self.tokens[end:min(article_end, end + width)]
+        return '\t'.join([
+            ' '.join(self.vocab[t] for t in left),
+            ' '.join(self.vocab[t] for t in match),
+            ' '.join(self.vocab[t] for t in right),
+            self.files[self.article_files[article]],
+            self.articles[article]
+        ])
+
+
+# ====================
+def print_concordance(phrase: str, width: int = 10, years: list = None,
+                      categories: list = None, limit: int = 100):
+    """Print concordance lines for a word or phrase"""
+
+    start_time = time.perf_counter()
+    index = ConcordanceIndex()
+    load_time = time.perf_counter()
+    phrase = phrase.split()
+    positions, articles = index.find(phrase, years, categories)
+    lines = [index.kwic_line(p, a, len(phrase), width)
+             for p, a in zip(positions[:limit or None],
+                             articles[:limit or None])]
+    end_time = time.perf_counter()
+    for line in lines:
+        print(line)
+    print()
+    print(f'{len(positions)} matches ({len(lines)} shown).',
+          f'Index loaded in {(load_time - start_time) * 1000:.0f} ms,',
+          f'query took {(end_time - load_time) * 1000:.0f} ms.')
+
+
+# ====================
+def main():
+
+    args = get_args()
+    if args.command == 'build':
+        build_index()
+    else:
+        print_concordance(args.phrase, args.width, args.year, args.category,
+                          args.limit)
+
+
+# ====================
+if __name__ == "__main__":
+
+    main()
@@ -25,23 +25,39 @@ Only categories present in both years will be included in the corpus.
 Documents will be chosen such that the number of words in each year is
 roughly equal for each category.
 
+If EXCLUDE_DUPLICATES is True, documents marked as near-duplicates by
+find_duplicates.py will not be included in the corpus.
+
+If ESTIMATE_SAMPLE_SIZE is set (to at least 2), the number of words available
+for each category for each year is estimated from a sample of that many files
+rather than counted (see estimate_jp_word_count in helper/text_helper.py).
+The estimates are only used to decide which year has fewer words in each
+category: the words for that year are then counted exactly, and the words for
+the other year are counted until that number is reached. This is much faster
+than counting every file when one year has many more words than the other.
+
 Non-tokenized ('raw') and tokenized versions of the corpus will be saved.
 Non-tokenized files will be saved in 'CORPUS_PATH/raw' and tokenized
 files will be saved in 'CORPUS_PATH/tokenized'.
 """
 
 from os.path import join as joinpath
+from os.path import normpath
 
 import pandas as pd
 
-from helper.file_helper import get_files_and_folders
-from helper.text_helper import (jp_word_count, sum_of_jp_word_counts,
-                                word_tokenize_line)
+from find_duplicates import load_duplicate_paths
+from helper.file_helper import (get_file_sizes, get_files_and_folders,
+                                get_lines_from_file)
+from helper.text_helper import (estimate_jp_word_count, jp_word_count,
+                                sum_of_jp_word_counts, word_tokenize_line)
 from helper.file_helper import save_text_to_file
 
 CORPUS_PATH = "E:/oshiete_corpus/"
 YEARS = ['2001', '2021']
 EXCLUDE_CATEGORIES = ['gooサービス', '公式アカウントからの質問']
+EXCLUDE_DUPLICATES = True
+ESTIMATE_SAMPLE_SIZE = None
 CATEGORY_NAME_TRANSLATIONS = {
     "ビジネス・キャリア": 'business-career',
     "悩み相談・人生相談": 'life-advice',
@@ -66,20 +82,34 @@ def build_corpus():
 
     See the module documentation for details."""
 
+    if ESTIMATE_SAMPLE_SIZE and ESTIMATE_SAMPLE_SIZE < 2:
+        raise ValueError('ESTIMATE_SAMPLE_SIZE must be at least 2, or None '
+                         'to count every file.')
+
     # Get categories to include
     categories = get_common_categories(exclude=EXCLUDE_CATEGORIES)
     print("Including the following categories",
           ", ".join(categories))
     print()
 
+    # Get documents to exclude
+    if EXCLUDE_DUPLICATES:
+        exclude_files = load_duplicate_paths()
+        print(f'Excluding {len(exclude_files)} near-duplicate documents')
+        print()
+    else:
+        exclude_files = set()
+
     # Get word counts for each category
     print('Word counts for each category in each year:')
-    category_counts = get_category_counts(categories)
+    category_counts = get_category_counts(categories, exclude_files,
+                                          ESTIMATE_SAMPLE_SIZE)
     print()
 
     # Build the corpus and get information about the files created
     print('Building corpus...')
-    files_and_word_counts = get_files_and_word_counts(category_counts)
+    files_and_word_counts = get_files_and_word_counts(
+        category_counts, exclude_files, estimated=bool(ESTIMATE_SAMPLE_SIZE))
     generate_corpus_files(files_and_word_counts)
     print()
 
@@ -105,6 +135,15 @@ def category_path(year: str, category: str):
     return joinpath(CORPUS_PATH, year, category)
 
 
+# ====================
+def get_category_files(year: str, category: str, exclude_files=set()):
+    """Get the list of files for a category for a year that are not in the
+    set of excluded files"""
+
+    files, _ = get_files_and_folders(category_path(year, category))
+    return [f for f in files if normpath(f) not in exclude_files]
+
+
 # ====================
 def get_common_categories(exclude=[]):
     """Get the list of categories that are present for both years and are not
@@ -121,18 +160,29 @@ def get_common_categories(exclude=[]):
 
 
 # ====================
-def get_category_counts(categories: list) -> dict:
+def get_category_counts(categories: list, exclude_files=set(),
+                        sample_size: int = None) -> dict:
     """Count how many total words are available for each category for each
-    year"""
+    year, not including the words in excluded files
+
+    If sample_size is given, estimate the counts from a sample of that many
+    files for each category for each year"""
 
     category_counts = {category: {} for category in categories}
     for category in category_counts.keys():
         word_count_info = f"{category}: "
         for year in YEARS:
-            files, _ = get_files_and_folders(category_path(year, category))
-            year_words = sum_of_jp_word_counts(files)
+            files = get_category_files(year, category, exclude_files)
+            if sample_size:
+                file_sizes = get_file_sizes(category_path(year, category))
+                year_words, margin = estimate_jp_word_count(
+                    {f: file_sizes[f] for f in files}, sample_size)
+                word_count_info = word_count_info + \
+                    f'{year}: ~{year_words} (± {margin}); '
+            else:
+                year_words = sum_of_jp_word_counts(files)
+                word_count_info = word_count_info + f'{year}: {year_words}; '
             category_counts[category][year] = year_words
-            word_count_info = word_count_info + f'{year}: {year_words}; '
         print(word_count_info)
     return category_counts
 
@@ -162,28 +212,51 @@ def files_to_reach_target(available_files: list,
 
 
 # ====================
-def get_files_and_word_counts(category_counts: dict) -> dict:
+def get_files_and_word_counts(category_counts: dict, exclude_files=set(),
+                              estimated: bool = False) -> dict:
     """Generate lists of files for each category for each year such that there
-    will be a roughly equal number of words in each category for each year"""
+    will be a roughly equal number of words in each category for each year
+
+    If estimated is True, the counts in category_counts are estimates and are
+    only used to decide which year has the fewest words. The words for that
+    year are then counted exactly before files are chosen for the other
+    years."""
 
     files_and_word_counts = {category: {}
                              for category in category_counts.keys()}
     for category in category_counts.keys():
-        target_word_count = min([category_counts[category][year]
-                                 for year in YEARS])
-        for year in YEARS:
-            path = (joinpath(CORPUS_PATH, year, category))
-            all_files, _ = get_files_and_folders(path)
-            # If this is the year with the fewest words available, include all
-            # the files
-            if category_counts[category][year] == target_word_count:
-                files_and_word_counts[category][year] \
-                    = (all_files, target_word_count)
-            # Otherwise, stop adding files at the point where the target word
-            # count is reached
+        year_files = {year: get_category_files(year, category, exclude_files)
+                      for year in YEARS}
+        smallest_year = min(YEARS, key=category_counts[category].get)
+        while True:
+            # Include all the files for the year with the fewest words
+            if estimated:
+                target_word_count = \
+                    sum_of_jp_word_counts(year_files[smallest_year])
+            else:
+                target_word_count = category_counts[category][smallest_year]
+            year_files_and_word_counts = {
+                smallest_year: (year_files[smallest_year], target_word_count)
+            }
+            # For the other years, stop adding files at the point where the
+            # target word count is reached
+            for year in YEARS:
+                if year == smallest_year:
+                    continue
+                try:
+                    year_files_and_word_counts[year] = \
+                        files_to_reach_target(year_files[year],
+                                              target_word_count)
+                except ValueError:
+                    if not estimated:
+                        raise
+                    # The estimates were in the wrong order, so start again
+                    # with this year as the year with the fewest words
+                    smallest_year = year
+                    break
             else:
-                files_and_word_counts[category][year] = \
-                    files_to_reach_target(all_files, target_word_count)
+                break
+        files_and_word_counts[category] = year_files_and_word_counts
 
     return files_and_word_counts
 
@@ -234,24 +307,22 @@ def concatenate_text_files(source_files: list, target_path_raw: str,
     save_text_to_file('', target_path_raw)
     with open(target_path_raw, 'w', encoding='utf-8') as target_file:
         for f in source_files:
-            with open(f, 'r', encoding='utf-8') as source_file:
-                target_file.write(article_start_tag(f))
-                target_file.write('\n')
-                for line in source_file.readlines():
-                    target_file.write(line)
-                target_file.write(ARTICLE_END_TAG)
-                target_file.write('\n\n')
+            target_file.write(article_start_tag(f))
+            target_file.write('\n')
+            for line in get_lines_from_file(f, errors='strict'):
+                target_file.write(line)
+            target_file.write(ARTICLE_END_TAG)
+            target_file.write('\n\n')
 
     save_text_to_file('', target_path_tokenized)
     with open(target_path_tokenized, 'w', encoding='utf-8') as target_file:
         for f in source_files:
-            with open(f, 'r', encoding='utf-8') as source_file:
-                target_file.write(article_start_tag(f))
-                target_file.write('\n')
-                for line in source_file.readlines():
-                    target_file.write(word_tokenize_line(line))
-                target_file.write(ARTICLE_END_TAG)
-                target_file.write('\n\n')
+            target_file.write(article_start_tag(f))
+            target_file.write('\n')
+            for line in get_lines_from_file(f, errors='strict'):
+                target_file.write(word_tokenize_line(line))
+            target_file.write(ARTICLE_END_TAG)
+            target_file.write('\n\n')
 
 
 # ====================
@@ -14,24 +14,64 @@ the base level, so any files in folders with subfolders are ignored.
 
 Assumes that only .txt files are in the folders, so behaviour may be
 unpredictable if other types of files are included.
+
+By default, word counts are estimated rather than counted, by counting the
+words in a random sample of files in each base level folder and applying
+the ratio of words to bytes in the sample to the total size of the files in
+the folder (see estimate_jp_word_count in helper/text_helper.py). Estimates
+are shown with a 95% confidence interval, e.g. '~1234567 words (± 5678)'.
+Margins for folders with subfolders are combined from those of their
+subfolders, assuming the estimates are independent.
+
+Run with --exact to count every word in every file instead.
+
+E.g.
+> python display_corpus_stats.py --sample-size 100
+> python display_corpus_stats.py --exact
 """
 
+import argparse
+import math
 import os
 from os.path import basename, normpath, relpath
 
-from helper.file_helper import get_files_and_folders
-from helper.text_helper import sum_of_jp_word_counts
+from helper.file_helper import get_file_sizes, get_files_and_folders
+from helper.text_helper import estimate_jp_word_count, sum_of_jp_word_counts
 
 CORPUS_PATH = "E:/oshiete_corpus/"
 
 
+# ====================
+def get_args():
+    """Get command-line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description='Display file and word counts for the corpus',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--exact',
+                        action='store_true',
+                        help='Count every word instead of estimating')
+    parser.add_argument('--sample-size',
+                        type=int,
+                        default=50,
+                        help='Number of files to count words in for each '
+                             'base level folder when estimating (at least 2)')
+    args = parser.parse_args()
+    if args.sample_size < 2:
+        parser.error('--sample-size must be at least 2')
+    return args
+
+
 # ====================
 class Folder:
 
     # ====================
-    def __init__(self, path):
+    def __init__(self, path, sample_size=None):
+        """sample_size is the number of files to count words in when
+        estimating word counts, or None to count all words"""
 
         path = normpath(path)
+        self.sample_size = sample_size
         self.abs_path = path
         self.base_name = basename(path)
         if path == normpath(CORPUS_PATH):
@@ -44,17 +84,16 @@ class Folder:
             self.files = []
         else:
             self.files = files
-        self.subfolders = [Folder(sf) for sf in subfolders]
+        self.subfolders = [Folder(sf, sample_size) for sf in subfolders]
 
     # ====================
     def get_file_word_counts(self):
 
         if self.files:
             num_files = self.get_num_files()
-            total_word_count = self.get_total_word_count()
             print(
                 f"{chr(9) * self.depth}{self.base_name}:",
-                f"{num_files} files, {total_word_count} words"
+                f"{num_files} files, {self.word_count_info()}"
             )
         else:
             print(
@@ -67,14 +106,23 @@ class Folder:
     def display(self):
 
         num_files = self.get_num_files()
-        total_word_count = self.get_total_word_count()
         print(
             f"{chr(9) * self.depth}{self.base_name}:",
-            f"{num_files} files, {total_word_count} words"
+            f"{num_files} files, {self.word_count_info()}"
         )
         for sf in self.subfolders:
             sf.display()
 
+    # ====================
+    def word_count_info(self):
+
+        total_word_count = self.get_total_word_count()
+        if self.sample_size is None:
+            return f"{total_word_count} words"
+        else:
+            margin = round(self.get_word_count_margin())
+            return f"~{total_word_count} words (± {margin})"
+
     # ====================
     def get_num_files(self):
 
@@ -91,19 +139,36 @@ class Folder:
 
         if hasattr(self, 'total_word_count'):
             return self.total_word_count
-        elif self.files:
+        elif self.files and self.sample_size is None:
             self.total_word_count = sum_of_jp_word_counts(self.files)
             return self.total_word_count
+        elif self.files:
+            file_sizes = get_file_sizes(self.abs_path)
+            self.total_word_count, self.word_count_margin = \
+                estimate_jp_word_count(file_sizes, self.sample_size)
+            return self.total_word_count
         else:
             return sum([sf.get_total_word_count() for sf in self.subfolders])
 
+    # ====================
+    def get_word_count_margin(self):
+
+        if self.files:
+            self.get_total_word_count()
+            return self.word_count_margin
+        else:
+            return math.sqrt(sum([sf.get_word_count_margin() ** 2
+                                  for sf in self.subfolders]))
+
 
 # ====================
 def main():
 
+    args = get_args()
+    sample_size = None if args.exact else args.sample_size
     os.system('cls')
     print('Determining folder structure...')
-    corpus_folder = Folder(CORPUS_PATH)
+    corpus_folder = Folder(CORPUS_PATH, sample_size)
     os.system('cls')
     print('Determined folder structure.',
           'Getting file and word counts for base level folders...')
@@ -0,0 +1,309 @@
+"""
+find_duplicates.py
+
+Find near-duplicate documents in the corpus, such as reposted questions and
+templated answers, so that they can be excluded when compiling the corpus.
+
+Documents are compared using MinHash signatures of their character
+shingles, which estimate the proportion of shingles two documents have in
+common (Jaccard similarity). Candidate pairs are found using locality
+sensitive hashing (LSH): each signature is split into NUM_BANDS bands and
+documents that share any band are compared, so documents never need to be
+compared pairwise.
+
+Signatures are calculated in parallel worker processes and documents are
+processed in batches of BATCH_SIZE, so memory use does not depend on the
+size of the corpus. Signatures and band hashes are stored in an SQLite
+database at DB_PATH.
+
+A document is marked as a duplicate of the earliest document found before
+it with an estimated similarity of at least THRESHOLD. Only documents that
+are not duplicates are added to the LSH bands, so that sets of many
+identical documents do not produce large numbers of candidate pairs.
+
+Only documents that are not already in the database are processed, so the
+program can be run again after scraping to check new documents against
+existing ones.
+
+E.g.
+> python find_duplicates.py
+
+Duplicates are excluded by corpus-compiler.py using load_duplicate_paths.
+"""
+
+import argparse
+import hashlib
+import sqlite3
+import time
+import zlib
+from multiprocessing import Pool
+from os.path import isfile, normpath
+from os.path import join as joinpath
+
+import numpy as np
+
+from helper.file_helper import get_text_from_file, iter_document_paths
+
+CORPUS_PATH = "E:/oshiete_corpus/"
+DB_PATH = joinpath(CORPUS_PATH, "duplicates.db")
+YEARS = ['2001', '2021']
+SHINGLE_LENGTH = 5
+NUM_PERM = 128
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERM // NUM_BANDS
+THRESHOLD = 0.8
+BATCH_SIZE = 5000
+# Maximum number of host parameters allowed in an SQLite query
+MAX_QUERY_PARAMS = 900
+
+# Hash functions for the MinHash permutations. The seed is fixed so that
+# signatures are the same in every worker process and every run.
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+_random_state = np.random.RandomState(1)
+PERM_A = _random_state.randint(1, MERSENNE_PRIME, size=NUM_PERM,
+                               dtype=np.uint64)
+PERM_B = _random_state.randint(0, MERSENNE_PRIME, size=NUM_PERM,
+                               dtype=np.uint64)
+
+
+# ====================
+def get_args():
+    """Get command-line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description='Find near-duplicate documents in the corpus',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--processes',
+                        type=int,
+                        default=None,
+                        help='Number of worker processes (defaults to the '
+                             'number of CPUs)')
+    return parser.parse_args()
+
+
+# ====================
+def open_database(db_path: str) -> sqlite3.Connection:
+    """Open the duplicates database, creating the tables if necessary"""
+
+    connection = sqlite3.connect(db_path)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            signature BLOB,
+            duplicate_of INTEGER,
+            similarity REAL
+        );
+        CREATE TABLE IF NOT EXISTS bands (
+            band INTEGER NOT NULL,
+            hash INTEGER NOT NULL,
+            doc_id INTEGER NOT NULL,
+            PRIMARY KEY (band, hash, doc_id)
+        ) WITHOUT ROWID;
+        CREATE TEMP TABLE batch_bands (
+            band INTEGER NOT NULL,
+            hash INTEGER NOT NULL,
+            doc_id INTEGER NOT NULL
+        );
+    """)
+    return connection
+
+
+# ====================
+def find_duplicates(processes: int = None):
+    """Add new documents to the duplicates database and mark those that are
+    near-duplicates of earlier documents.
+
+    See the module documentation for details."""
+
+    start_time = time.perf_counter()
+    connection = open_database(DB_PATH)
+    num_docs = 0
+    num_duplicates = 0
+    new_paths = iter_new_paths(connection,
+                               iter_document_paths(CORPUS_PATH, YEARS))
+    with Pool(processes) as pool:
+        # Calculate signatures for the next batch while the current batch
+        # is being added to the database
+        previous_batch = None
+        for paths in iter_batches(new_paths, BATCH_SIZE):
+            batch = (paths, pool.map_async(get_signature, paths,
+                                           chunksize=64))
+            if previous_batch:
+                num_duplicates += add_batch(connection, previous_batch[0],
+                                            previous_batch[1].get())
+                num_docs += len(previous_batch[0])
+                print(f'{num_docs} new documents processed,',
+                      f'{num_duplicates} duplicates found',
+                      f'({time.perf_counter() - start_time:.0f} seconds).')
+            previous_batch = batch
+        if previous_batch:
+            num_duplicates += add_batch(connection, previous_batch[0],
+                                        previous_batch[1].get())
+            num_docs += len(previous_batch[0])
+
+    total_docs, total_duplicates = connection.execute(
+        "SELECT COUNT(*), COUNT(duplicate_of) FROM documents").fetchone()
+    connection.close()
+    print(f'Processed {num_docs} new documents and found {num_duplicates}',
+          f'duplicates in {time.perf_counter() - start_time:.1f} seconds.')
+    print(f'{total_duplicates} of {total_docs} documents in the database are',
+          'duplicates.')
+
+
+# ====================
+def iter_batches(iterable, batch_size: int):
+    """Yield lists of up to batch_size items from an iterable"""
+
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ====================
+def iter_new_paths(connection: sqlite3.Connection, paths):
+    """Yield the paths that are not already in the database"""
+
+    for batch in iter_batches(paths, MAX_QUERY_PARAMS):
+        query = "SELECT path FROM documents WHERE path IN " + \
+                f"({','.join('?' * len(batch))})"
+        existing = {row[0] for row in connection.execute(query, batch)}
+        yield from (p for p in batch if p not in existing)
+
+
+# ====================
+def get_signature(file_path: str) -> tuple:
+    """Get the MinHash signature and LSH band hashes for a document
+
+    Return a tuple (signature, band_hashes), or (None, None) if the document
+    contains no text"""
+
+    text = ''.join(get_text_from_file(file_path).split())
+    if not text:
+        return (None, None)
+    shingles = {text[i:i + SHINGLE_LENGTH]
+                for i in range(max(len(text) - SHINGLE_LENGTH + 1, 1))}
+    shingle_hashes = np.fromiter(
+        (zlib.crc32(s.encode('utf-8')) for s in shingles),
+        dtype=np.uint64, count=len(shingles))
+    # Overflow in the multiplication is intended
+    permuted = (shingle_hashes[:, np.newaxis] * PERM_A + PERM_B) \
+        % MERSENNE_PRIME & MAX_HASH
+    signature = permuted.min(axis=0).astype(np.uint32)
+    band_hashes = [
+        int.from_bytes(
+            hashlib.blake2b(band.tobytes(), digest_size=8).digest(),
+            'little', signed=True)
+        for band in signature.reshape(NUM_BANDS, ROWS_PER_BAND)
+    ]
+    return (signature, band_hashes)
+
+
+# ====================
+def similarity(signature_1: np.ndarray, signature_2: np.ndarray) -> float:
+    """Estimate the Jaccard similarity of two documents from their
+    signatures"""
+
+    return float(np.mean(signature_1 == signature_2))
+
+
+# ====================
+def add_batch(connection: sqlite3.Connection, paths: list,
+              signatures: list) -> int:
+    """Add a batch of documents to the database, marking any that are
+    duplicates of earlier documents
+
+    Return the number of duplicates found"""
+
+    with connection:
+        doc_ids = []
+        for path, (signature, _) in zip(paths, signatures):
+            cursor = connection.execute(
+                "INSERT INTO documents (path, signature) VALUES (?, ?)",
+                (path, None if signature is None else signature.tobytes()))
+            doc_ids.append(cursor.lastrowid)
+
+        # Get candidates from earlier batches
+        connection.execute("DELETE FROM batch_bands")
+        connection.executemany(
+            "INSERT INTO batch_bands VALUES (?, ?, ?)",
+            ((band, band_hash, doc_id)
+             for doc_id, (_, band_hashes) in zip(doc_ids, signatures)
+             if band_hashes is not None
+             for band, band_hash in enumerate(band_hashes)))
+        candidates = {}
+        candidate_signatures = {}
+        rows = connection.execute("""
+            SELECT DISTINCT n.doc_id, d.id, d.signature
+            FROM batch_bands n
+            JOIN bands b ON b.band = n.band AND b.hash = n.hash
+            JOIN documents d ON d.id = b.doc_id
+        """)
+        for doc_id, candidate_id, candidate_signature in rows:
+            candidates.setdefault(doc_id, set()).add(candidate_id)
+            candidate_signatures[candidate_id] = np.frombuffer(
+                candidate_signature, dtype=np.uint32)
+
+        # Check documents in order, adding candidates from earlier in this
+        # batch
+        batch_bands = {}
+        new_bands = []
+        duplicates = []
+        for doc_id, (signature, band_hashes) in zip(doc_ids, signatures):
+            if signature is None:
+                continue
+            doc_candidates = candidates.get(doc_id, set())
+            for band in enumerate(band_hashes):
+                doc_candidates.update(batch_bands.get(band, []))
+            for candidate_id in sorted(doc_candidates):
+                score = similarity(signature,
+                                   candidate_signatures[candidate_id])
+                if score >= THRESHOLD:
+                    duplicates.append((candidate_id, score, doc_id))
+                    break
+            else:
+                candidate_signatures[doc_id] = signature
+                for band in enumerate(band_hashes):
+                    batch_bands.setdefault(band, []).append(doc_id)
+                    new_bands.append((*band, doc_id))
+
+        connection.executemany(
+            "UPDATE documents SET duplicate_of = ?, similarity = ? "
+            "WHERE id = ?", duplicates)
+        connection.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                               new_bands)
+    return len(duplicates)
+
+
+# ====================
+def load_duplicate_paths(db_path: str = DB_PATH) -> set:
+    """Get the set of paths of documents that are near-duplicates of earlier
+    documents, or an empty set if find_duplicates has not been run"""
+
+    if not isfile(db_path):
+        return set()
+    connection = sqlite3.connect(db_path)
+    rows = connection.execute(
+        "SELECT path FROM documents WHERE duplicate_of IS NOT NULL")
+    duplicate_paths = {normpath(row[0]) for row in rows}
+    connection.close()
+    return duplicate_paths
+
+
+# ====================
+def main():
+
+    args = get_args()
+    find_duplicates(args.processes)
+
+
+# ====================
+if __name__ == "__main__":
+
+    main()
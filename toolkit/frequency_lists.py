@@ -0,0 +1,240 @@
+"""
+frequency_lists.py
+
+Build word frequency lists for each year and category of the compiled
+corpus and calculate the keyness of each word between the years.
+
+Reads the tokenized corpus files created by corpus-compiler.py, which are
+stored in CORPUS_PATH/tokenized and named <year>_<category>.txt.
+
+Each corpus file is counted in a separate worker process (map). The counts
+from each worker are then merged (reduce) into a single NumPy matrix with a
+row for each corpus file and a column for each word (integer token ID), so
+that year and category totals and keyness statistics can be calculated for
+all words at once.
+
+Output is saved as .csv files (UTF-8 with BOM so that they can be opened in
+Excel) in the following structure:
+
+CORPUS_PATH/frequency
+├── 2001.csv                    frequency list for the whole year
+├── 2001_business-career.csv    frequency list for a single category
+├── etc.
+├── keyness.csv                 keyness between years for the whole corpus
+├── keyness_business-career.csv keyness between years for a single category
+└── etc.
+
+Keyness is measured using log-likelihood (Dunning, 1993) and log ratio
+(Hardie, 2014). Log ratio is the binary log of the ratio of the relative
+frequencies in the second year in YEARS to those in the first year, so
+positive values indicate words that became more frequent over time. Keyness
+tables are sorted by log-likelihood.
+
+E.g.
+> python frequency_lists.py --min-freq 5
+"""
+
+import argparse
+import time
+from collections import Counter
+from multiprocessing import Pool
+from os.path import join as joinpath
+
+import numpy as np
+import pandas as pd
+
+from helper.corpus_helper import (get_corpus_files, iter_articles,
+                                  parse_corpus_file_name)
+from helper.file_helper import save_text_to_file
+
+CORPUS_PATH = "E:/oshiete_corpus/"
+TOKENIZED_PATH = joinpath(CORPUS_PATH, 'tokenized')
+OUTPUT_PATH = joinpath(CORPUS_PATH, 'frequency')
+YEARS = ['2001', '2021']
+# Frequency used in place of zero when calculating log ratio
+LOG_RATIO_ZERO_FREQ = 0.5
+
+
+# ====================
+def get_args():
+    """Get command-line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description='Build frequency lists and keyness tables',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--processes',
+                        type=int,
+                        default=None,
+                        help='Number of worker processes (defaults to the '
+                             'number of CPUs)')
+    parser.add_argument('--min-freq',
+                        type=int,
+                        default=1,
+                        help='Minimum combined frequency in both years for '
+                             'a word to be included in keyness tables')
+    return parser.parse_args()
+
+
+# ====================
+def build_frequency_tables(processes: int = None, min_freq: int = 1):
+    """Build the frequency lists and keyness tables.
+
+    See the module documentation for details."""
+
+    start_time = time.perf_counter()
+    corpus_files = get_corpus_files(TOKENIZED_PATH)
+    file_info = [parse_corpus_file_name(f) for f in corpus_files]
+    print(f'Counting tokens in {len(corpus_files)} files...')
+    vocab, freq_matrix = get_frequency_matrix(corpus_files, processes)
+    print(f'Found {freq_matrix.sum()} tokens and {len(vocab)} types in',
+          f'{time.perf_counter() - start_time:.1f} seconds.')
+    save_text_to_file('', joinpath(OUTPUT_PATH, 'keyness.csv'))
+
+    # Frequency lists and keyness for the whole corpus
+    year_freqs = {}
+    for year in YEARS:
+        rows = [i for i, (year_, _) in enumerate(file_info) if year_ == year]
+        year_freqs[year] = freq_matrix[rows].sum(axis=0)
+        save_frequency_list(vocab, year_freqs[year],
+                            joinpath(OUTPUT_PATH, f'{year}.csv'))
+    save_keyness_table(vocab, year_freqs[YEARS[0]], year_freqs[YEARS[1]],
+                       joinpath(OUTPUT_PATH, 'keyness.csv'), min_freq)
+
+    # Frequency lists and keyness for each category
+    file_rows = {info: i for i, info in enumerate(file_info)}
+    categories = sorted(set(category for _, category in file_info))
+    for category in categories:
+        if not all((year, category) in file_rows for year in YEARS):
+            print(f'Skipping keyness for {category}: not present in all',
+                  'years.')
+            continue
+        category_freqs = [freq_matrix[file_rows[(year, category)]]
+                          for year in YEARS]
+        for year, freqs in zip(YEARS, category_freqs):
+            save_frequency_list(
+                vocab, freqs, joinpath(OUTPUT_PATH, f'{year}_{category}.csv'))
+        save_keyness_table(
+            vocab, *category_freqs,
+            joinpath(OUTPUT_PATH, f'keyness_{category}.csv'), min_freq)
+
+    print(f'Frequency lists and keyness tables saved to {OUTPUT_PATH} in',
+          f'{time.perf_counter() - start_time:.1f} seconds.')
+
+
+# ====================
+def count_tokens(file_path: str) -> tuple:
+    """Count the tokens in a tokenized corpus file
+
+    Return a tuple (types, counts) where types is a list of the token types
+    found and counts is an array of the frequency of each type"""
+
+    with open(file_path, encoding='utf-8') as f:
+        corpus_text = f.read()
+    counter = Counter()
+    for _, article_text in iter_articles(corpus_text):
+        counter.update(article_text.split())
+    counts = np.fromiter(counter.values(), dtype=np.int64,
+                         count=len(counter))
+    return (list(counter.keys()), counts)
+
+
+# ====================
+def get_frequency_matrix(corpus_files: list, processes: int = None) -> tuple:
+    """Count the tokens in each file in parallel and merge the results
+
+    Return a tuple (vocab, freq_matrix) where vocab is an array of token types
+    indexed by token ID and freq_matrix[i, j] is the frequency of the token
+    with ID j in corpus_files[i]"""
+
+    with Pool(processes) as pool:
+        file_counts = pool.map(count_tokens, corpus_files)
+
+    # Assign integer IDs to token types
+    token_ids = {}
+    file_token_ids = []
+    for types, _ in file_counts:
+        file_token_ids.append(np.fromiter(
+            (token_ids.setdefault(t, len(token_ids)) for t in types),
+            dtype=np.int64, count=len(types)))
+
+    freq_matrix = np.zeros((len(corpus_files), len(token_ids)),
+                           dtype=np.int64)
+    for row, (ids, (_, counts)) in enumerate(zip(file_token_ids,
+                                                 file_counts)):
+        freq_matrix[row, ids] = counts
+    vocab = np.array(list(token_ids.keys()), dtype=object)
+    return (vocab, freq_matrix)
+
+
+# ====================
+def keyness(freqs_1: np.ndarray, freqs_2: np.ndarray) -> tuple:
+    """Calculate log-likelihood and log ratio for each word given its
+    frequencies in two corpora
+
+    Return a tuple (log_likelihood, log_ratio) of arrays"""
+
+    a = freqs_1.astype(np.float64)
+    b = freqs_2.astype(np.float64)
+    c = a.sum()
+    d = b.sum()
+    expected_1 = c * (a + b) / (c + d)
+    expected_2 = d * (a + b) / (c + d)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_likelihood = 2 * (
+            np.where(a > 0, a * np.log(a / expected_1), 0)
+            + np.where(b > 0, b * np.log(b / expected_2), 0)
+        )
+    log_ratio = np.log2(
+        (np.where(b > 0, b, LOG_RATIO_ZERO_FREQ) / d)
+        / (np.where(a > 0, a, LOG_RATIO_ZERO_FREQ) / c)
+    )
+    return (log_likelihood, log_ratio)
+
+
+# ====================
+def save_frequency_list(vocab: np.ndarray, freqs: np.ndarray, path: str):
+    """Save a frequency list sorted by frequency"""
+
+    present = np.flatnonzero(freqs)
+    order = present[np.argsort(-freqs[present], kind='stable')]
+    freq_list = pd.DataFrame({
+        'word': vocab[order],
+        'frequency': freqs[order],
+        'per_million': freqs[order] * 1_000_000 / freqs.sum()
+    })
+    freq_list.index = np.arange(1, len(order) + 1)
+    freq_list.to_csv(path, index_label='rank', encoding='utf-8-sig')
+
+
+# ====================
+def save_keyness_table(vocab: np.ndarray, freqs_1: np.ndarray,
+                       freqs_2: np.ndarray, path: str, min_freq: int = 1):
+    """Save a table of keyness statistics sorted by log-likelihood"""
+
+    log_likelihood, log_ratio = keyness(freqs_1, freqs_2)
+    included = np.flatnonzero((freqs_1 + freqs_2) >= max(min_freq, 1))
+    order = included[np.argsort(-log_likelihood[included], kind='stable')]
+    keyness_table = pd.DataFrame({
+        'word': vocab[order],
+        f'freq_{YEARS[0]}': freqs_1[order],
+        f'freq_{YEARS[1]}': freqs_2[order],
+        f'per_million_{YEARS[0]}': freqs_1[order] * 1_000_000 / freqs_1.sum(),
+        f'per_million_{YEARS[1]}': freqs_2[order] * 1_000_000 / freqs_2.sum(),
+        'log_likelihood': log_likelihood[order],
+        'log_ratio': log_ratio[order]
+    })
+    keyness_table.index = np.arange(1, len(order) + 1)
+    keyness_table.to_csv(path, index_label='rank', encoding='utf-8-sig')
+
+
+# ====================
+def main():
+
+    args = get_args()
+    build_frequency_tables(args.processes, args.min_freq)
+
+
+# ====================
+if __name__ == "__main__":
+
+    main()
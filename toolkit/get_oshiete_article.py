@@ -3,16 +3,33 @@ get_oshiete_article.py
 
 Defines PageResult class for getting information from a Q&A page on the
 website oshiete.goo.ne.jp.
+
+In streaming mode, pages are scanned by YearScanner as they are downloaded.
+The download is stopped as soon as it is certain that the page has no
+content from the year required (i.e. the question was posted after that
+year, so no answers can have been posted in it either), and the full page is
+only parsed with BeautifulSoup if it has a question or answer from that
+year. The bytes and CPU time saved are reported for each page skipped.
 """
 
+import codecs
+import hashlib
+import time
+from html.parser import HTMLParser
+
 import bs4
 
 from helper.file_helper import save_text_to_file
-from helper.html_helper import get_all_text, get_bs
+from helper.html_helper import (bs_from_html, get_all_text,
+                                get_html_and_headers, stream_html)
 
 TEST_PAGE_URL = "https://oshiete.goo.ne.jp/qa/49186.html"
 TEST_PAGE_YEAR = 2001
 
+# Totals for pages parsed in full in streaming mode, used to estimate the
+# CPU time saved by not parsing skipped pages
+full_parse_stats = {'pages': 0, 'bytes': 0, 'seconds': 0.0}
+
 
 class PageResult:
     """
@@ -34,9 +51,28 @@ class PageResult:
         the text from the question and all answers on the page that
         were written in the year specified, separated by \n\n.
         Does not include extra comments, thank yous etc.
+    bytes_read: int
+        (streaming mode only) the number of bytes downloaded
+    bytes_saved: int
+        (streaming mode only) the number of bytes not downloaded because
+        the download was stopped early. Estimated from the average page
+        size if the server did not send the page size.
+    cpu_saved: float
+        (streaming mode only) the estimated CPU time in seconds saved by
+        streaming. For pages that were skipped, this is the time it would
+        have taken to parse the page in full less the time spent scanning
+        it, or None if no pages have been parsed in full yet to base the
+        estimate on. For pages that were parsed in full, it is minus the time
+        spent scanning them. Negative values mean streaming cost CPU time.
+    refresh_info: dict
+        (successfully scraped pages only) the ETag and Last-Modified headers
+        and the fingerprint of the page (see get_refresh_info), used by
+        scrape_oshiete.py to check whether the page has changed when
+        refreshing. None if the HTML was passed in without headers.
     """
 
-    def __init__(self, url: str, year: int):
+    def __init__(self, url: str, year: int, streaming: bool = False,
+                 html: bytes = None, headers=None):
         """
         Scrape the page and store the results in the attributes.
 
@@ -51,11 +87,28 @@ class PageResult:
             year will be included in the text attribute, and if no
             content written in the year is found 'success' will be set
             to False
+        streaming: bool
+            Whether to scan the page as it is downloaded and skip pages
+            with no content from the year specified as early as possible
+        html: bytes
+            The HTML of the page, if it has already been downloaded
+        headers
+            The response headers for the HTML, if it has already been
+            downloaded
         """
 
         # Get page HTML
+        scanner = None
         try:
-            bs = get_bs(url)
+            if html is not None:
+                bs = bs_from_html(html)
+            elif streaming:
+                bs, html, headers, scanner = self.get_bs_streaming(url, year)
+                if bs is None:
+                    return
+            else:
+                html, headers = get_html_and_headers(url)
+                bs = bs_from_html(html)
         except Exception as e:
             self.success = False
             self.err_msg = f'<<<{e}>>> error while getting HTML.'
@@ -85,8 +138,203 @@ class PageResult:
             return
         else:
             self.success = True
+            self.refresh_info = None if headers is None \
+                else get_refresh_info(html, headers, year, scanner)
             return
 
+    def get_bs_streaming(self, url: str, year: int) -> tuple:
+        """Download and scan the page, and get a BeautifulSoup object for it
+        if it might have content from the year specified.
+
+        Return a tuple (bs, html, headers, scanner) with the BeautifulSoup
+        object, the HTML, the response headers and the YearScanner used.
+        If the page has no content from the year, bs is None, success is
+        set to False and err_msg is set to a description of the savings
+        made."""
+
+        def on_chunk(chunk):
+            scanner.scan(chunk)
+            return scanner.no_target_year()
+
+        start_cpu = time.process_time()
+        scanner = YearScanner(year)
+        html, headers, complete = stream_html(url, on_chunk)
+        scan_cpu = time.process_time() - start_cpu
+        content_length = headers.get('Content-Length')
+        content_length = int(content_length) if content_length else None
+        self.bytes_read = len(html)
+        page_size = estimate_page_size(html, content_length, complete)
+        self.bytes_saved = page_size - self.bytes_read
+
+        if complete and not scanner.may_have_target_year():
+            reason = f'No content written in {year} found while scanning.'
+        elif not complete:
+            reason = f'Question was written in {scanner.question_year}.'
+        else:
+            # Parse the full page and record how long it took
+            start_parse_cpu = time.process_time()
+            bs = bs_from_html(html)
+            full_parse_stats['pages'] += 1
+            full_parse_stats['bytes'] += len(html)
+            full_parse_stats['seconds'] += \
+                time.process_time() - start_parse_cpu
+            # Scanning did not save anything for this page
+            self.cpu_saved = -scan_cpu
+            return (bs, html, headers, scanner)
+
+        if full_parse_stats['bytes']:
+            self.cpu_saved = (full_parse_stats['seconds']
+                              / full_parse_stats['bytes'] * page_size
+                              - scan_cpu)
+            if self.cpu_saved >= 0:
+                cpu_info = f'{self.cpu_saved * 1000:.1f} ms CPU'
+            else:
+                cpu_info = f'but cost {-self.cpu_saved * 1000:.1f} ms CPU'
+        else:
+            self.cpu_saved = None
+            cpu_info = 'unknown CPU time'
+        self.success = False
+        self.err_msg = (f'{reason} Skipped after reading {self.bytes_read} '
+                        f'bytes (saved {self.bytes_saved} bytes, '
+                        f'{cpu_info}).')
+        return (None, html, headers, scanner)
+
+
+# ====================
+class YearScanner(HTMLParser):
+    """
+    An incremental HTML parser that finds the year each question and
+    answer on a page was written in as the page is downloaded, without
+    building a BeautifulSoup object.
+
+    Follows the same rules as get_q_a_text for finding the year.
+
+    Attributes
+    ----------
+
+    year: int
+        the year content is required for
+    qa_years: list
+        the year each question and answer found so far was written in.
+        None for questions and answers with no <time> tag, and 0 if the
+        year could not be determined from the <time> tag.
+    question_year: int
+        the year the question was written in, or None if not found yet
+    qa_times: list
+        the text of the <time> tag for each question and answer found so
+        far, or None for questions and answers with no <time> tag
+    """
+
+    def __init__(self, year: int):
+
+        super().__init__()
+        self.year = year
+        self.qa_years = []
+        self.qa_times = []
+        self.question_year = None
+        self.in_question = False
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        # Whether each <div> currently open is a question or answer
+        self.div_stack = []
+        self.time_text = None
+
+    def scan(self, chunk: bytes):
+        """Scan the next chunk of bytes of the page"""
+
+        self.feed(self.decoder.decode(chunk))
+
+    def no_target_year(self) -> bool:
+        """Return True if it is certain that there is no content from the
+        required year. Answers cannot be older than the question, so this is
+        the case once the question is found to be from a later year."""
+
+        return self.question_year is not None \
+            and self.question_year > self.year
+
+    def may_have_target_year(self) -> bool:
+        """Return True if any of the questions and answers scanned so far
+        might be from the required year"""
+
+        return any(y == self.year or y == 0 for y in self.qa_years)
+
+    def fingerprint(self) -> str:
+        """Get a hash of the times of the questions and answers scanned,
+        which changes when answers are added to or removed from the
+        page"""
+
+        times = '\n'.join(t or '' for t in self.qa_times)
+        return hashlib.sha256(times.encode('utf-8')).hexdigest()
+
+    def handle_starttag(self, tag, attrs):
+
+        if tag == 'div':
+            classes = (dict(attrs).get('class') or '').split()
+            is_qa = 'q_article' in classes or 'a_article' in classes
+            if is_qa and not any(self.div_stack):
+                self.qa_years.append(None)
+                self.qa_times.append(None)
+                self.in_question = 'q_article' in classes
+            self.div_stack.append(is_qa)
+        elif tag == 'time' and any(self.div_stack) \
+                and self.qa_years[-1] is None and self.time_text is None:
+            self.time_text = ''
+
+    def handle_endtag(self, tag):
+
+        if tag == 'div' and self.div_stack:
+            self.div_stack.pop()
+        elif tag == 'time' and self.time_text is not None:
+            self.qa_times[-1] = self.time_text
+            try:
+                self.qa_years[-1] = int(self.time_text.partition('/')[0])
+            except ValueError:
+                self.qa_years[-1] = 0
+            if self.in_question:
+                self.question_year = self.qa_years[-1]
+            self.time_text = None
+
+    def handle_data(self, data):
+
+        if self.time_text is not None:
+            self.time_text += data.strip()
+
+
+# ====================
+def get_refresh_info(html: bytes, headers, year: int,
+                     scanner: YearScanner = None) -> dict:
+    """Get the ETag and Last-Modified headers for a page and a fingerprint
+    of the times of its questions and answers (see YearScanner.fingerprint)
+
+    scanner is a YearScanner that has already scanned the whole page, if
+    there is one. Otherwise the page is scanned."""
+
+    if scanner is None:
+        scanner = YearScanner(year)
+        scanner.scan(html)
+    return {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'fingerprint': scanner.fingerprint()
+    }
+
+
+# ====================
+def estimate_page_size(html: bytes, content_length: int,
+                       complete: bool) -> int:
+    """Get the size of a page in bytes, using the average size of pages
+    parsed in full if the download was stopped early and the size was not
+    given in the response headers"""
+
+    if complete:
+        return len(html)
+    elif content_length:
+        return content_length
+    elif full_parse_stats['pages']:
+        return max(len(html),
+                   full_parse_stats['bytes'] // full_parse_stats['pages'])
+    else:
+        return len(html)
+
 
 # ====================
 def get_main_category(bs: bs4.BeautifulSoup) -> str:
@@ -134,11 +382,11 @@ def get_q_a_text(qa: bs4.element.Tag, year: int) -> str:
 
 
 # ====================
-def print_test_page(url: str, year: int):
+def print_test_page(url: str, year: int, streaming: bool = False):
     """Print category and save text content to current working directory
     for a single page with the given URL."""
 
-    page_result = PageResult(url, year)
+    page_result = PageResult(url, year, streaming)
     if page_result.success:
         print(page_result.success)
         print(page_result.category)
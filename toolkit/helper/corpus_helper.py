@@ -0,0 +1,35 @@
+import re
+from os.path import basename, splitext
+
+from helper.file_helper import get_file_paths
+
+ARTICLE_REGEX = re.compile(r'<article localpath="(.*?)">(.*?)</article>',
+                           re.DOTALL)
+
+
+# ====================
+def get_corpus_files(folder_path: str) -> list:
+    """Get the paths of the compiled corpus files (e.g. the files in
+    CORPUS_PATH/tokenized) in a consistent order"""
+
+    return sorted([f for f in get_file_paths(folder_path)
+                   if f.endswith('.txt')])
+
+
+# ====================
+def parse_corpus_file_name(file_path: str) -> tuple:
+    """Get a tuple (year, category) from the name of a compiled corpus file
+
+    E.g. '2001_business-career.txt' -> ('2001', 'business-career')"""
+
+    year, _, category = splitext(basename(file_path))[0].partition('_')
+    return (year, category)
+
+
+# ====================
+def iter_articles(corpus_text: str):
+    """Yield a tuple (localpath, text) for each article in the text of a
+    compiled corpus file"""
+
+    for match in ARTICLE_REGEX.finditer(corpus_text):
+        yield (match.group(1), match.group(2))
@@ -1,24 +1,313 @@
-from os import listdir, makedirs, remove
-from os.path import isdir, isfile, join, dirname
+import io
+from os import listdir, makedirs, remove, replace, scandir, stat
+from os.path import basename, isdir, isfile, join, dirname
 import shutil
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Documents can be stored compressed with a zstd dictionary trained on the
+# corpus (see compress_corpus.py). Compressed documents keep their .txt file
+# names and are recognised by the zstd frame header. The dictionary is
+# stored in a file named ZSTD_DICT_FILE_NAME in the corpus folder, which is
+# found by searching the folders containing the document.
+ZSTD_MAGIC_NUMBER = b'\x28\xb5\x2f\xfd'
+ZSTD_DICT_FILE_NAME = 'documents.zdict'
+# High compression levels are slow, so use a low level when documents are
+# saved as they are scraped and a high level when compressing the corpus
+# offline
+ZSTD_COMPRESSION_LEVEL = 19
+ZSTD_FAST_COMPRESSION_LEVEL = 3
+zstd_dict_paths = {}
+zstd_compressors = {}
+zstd_decompressors = {}
+
+# Compressed documents can also be packed into a single file per folder (see
+# compress_corpus.py), so that each small document does not take up a whole
+# disk block. Packed documents keep their paths: a document that does not
+# exist as a file is looked up in the pack index for its folder,
+# PACK_INDEX_FILE_NAME. The first line of the index is the name of the pack
+# file, and each following line is
+#   file_name<TAB>offset<TAB>length<TAB>text_size
+# for a document stored as a zstd frame of length bytes at offset in the pack
+# file, where text_size is the size of the document before compressing. Files
+# take precedence over packed documents with the same name, so documents can
+# be updated by saving them as files until the folder is packed again.
+PACK_INDEX_FILE_NAME = 'documents.idx'
+PACK_FILE_PREFIX = 'documents-'
+PACK_FILE_EXTENSION = '.pack'
+pack_indexes = {}
+
 
 # ====================
-def save_text_to_file(text: str, file_path: str):
+def save_text_to_file(text: str, file_path: str, zstd_dict_path: str = None,
+                      compression_level: int = ZSTD_COMPRESSION_LEVEL):
+    """Save text to a file, compressed with the zstd dictionary at
+    zstd_dict_path if given"""
 
     makedirs(dirname(file_path), exist_ok=True)
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write(text)
+    if zstd_dict_path:
+        compressor = get_zstd_compressor(zstd_dict_path, compression_level)
+        with open(file_path, 'wb') as f:
+            f.write(compressor.compress(text.encode('utf-8')))
+    else:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(text)
 
 
 # ====================
-def get_text_from_file(file_path: str) -> str:
+def get_text_from_file(file_path: str, errors: str = 'ignore') -> str:
+    """Get text from a file, decompressing it first if it is a compressed
+    document
+
+    errors is passed to the UTF-8 decoder, as in open()"""
 
-    with open(file_path, errors='ignore') as f:
+    data = get_bytes_from_file(file_path)
+    # Decode in the same way as reading the file in text mode
+    with io.TextIOWrapper(io.BytesIO(data), encoding='utf-8',
+                          errors=errors) as f:
         text = f.read()
     return text
 
 
+# ====================
+def get_bytes_from_file(file_path: str) -> bytes:
+    """Get the bytes in a file, or in a packed document, decompressing them
+    first if they are compressed"""
+
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = read_packed_document(file_path)
+    if data.startswith(ZSTD_MAGIC_NUMBER):
+        zstd_dict_path = find_zstd_dict(file_path)
+        if zstd_dict_path not in zstd_decompressors:
+            zstd_dict = load_zstd_dict(zstd_dict_path)
+            zstd_decompressors[zstd_dict_path] = zstandard.ZstdDecompressor(
+                dict_data=zstd_dict)
+        data = zstd_decompressors[zstd_dict_path].decompress(data)
+    return data
+
+
+# ====================
+def get_lines_from_file(file_path: str, errors: str = 'ignore') -> list:
+    """Get the lines of text in a file, as returned by readlines, decompressing
+    it first if it is a compressed document"""
+
+    return io.StringIO(get_text_from_file(file_path, errors)).readlines()
+
+
+# ====================
+def is_compressed_file(file_path: str) -> bool:
+    """Return True if a document is compressed, which packed documents
+    always are"""
+
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(len(ZSTD_MAGIC_NUMBER)) == ZSTD_MAGIC_NUMBER
+    except FileNotFoundError:
+        if basename(file_path) in load_pack_index(dirname(file_path))[1]:
+            return True
+        raise
+
+
+# ====================
+def get_zstd_compressor(zstd_dict_path: str, compression_level: int):
+
+    key = (zstd_dict_path, compression_level)
+    if key not in zstd_compressors:
+        zstd_dict = load_zstd_dict(zstd_dict_path)
+        zstd_compressors[key] = zstandard.ZstdCompressor(
+            level=compression_level, dict_data=zstd_dict)
+    return zstd_compressors[key]
+
+
+# ====================
+def load_zstd_dict(zstd_dict_path: str):
+
+    if zstandard is None:
+        raise ImportError('The zstandard package is required to read and '
+                          'write compressed documents.')
+    with open(zstd_dict_path, 'rb') as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+
+# ====================
+def find_zstd_dict(file_path: str) -> str:
+    """Find the zstd dictionary for a compressed document in the folders
+    containing it"""
+
+    folder = dirname(file_path)
+    if folder not in zstd_dict_paths:
+        parent = dirname(folder)
+        if isfile(join(folder, ZSTD_DICT_FILE_NAME)):
+            zstd_dict_paths[folder] = join(folder, ZSTD_DICT_FILE_NAME)
+        elif parent == folder:
+            raise FileNotFoundError('Could not find the zstd dictionary '
+                                    f'({ZSTD_DICT_FILE_NAME}) for {file_path}')
+        else:
+            zstd_dict_paths[folder] = find_zstd_dict(folder)
+    return zstd_dict_paths[folder]
+
+
+# ====================
+def load_pack_index(folder_path: str) -> tuple:
+    """Get the pack index for a folder
+
+    Return a tuple (pack_path, documents) where documents is a dictionary of
+    file names and tuples (offset, length, text_size), or (None, {}) if the
+    folder has not been packed"""
+
+    if folder_path not in pack_indexes:
+        index_path = join(folder_path, PACK_INDEX_FILE_NAME)
+        if not isfile(index_path):
+            return (None, {})
+        with open(index_path, encoding='utf-8') as f:
+            pack_path = join(folder_path, f.readline().strip())
+            documents = {}
+            for line in f:
+                file_name, offset, length, text_size = line.split('\t')
+                documents[file_name] = (int(offset), int(length),
+                                        int(text_size))
+        pack_indexes[folder_path] = (pack_path, documents)
+    return pack_indexes[folder_path]
+
+
+# ====================
+def read_packed_document(file_path: str) -> bytes:
+    """Get the bytes stored for a packed document"""
+
+    pack_path, documents = load_pack_index(dirname(file_path))
+    if basename(file_path) not in documents:
+        raise FileNotFoundError(f'No such file or packed document: '
+                                f'{file_path}')
+    offset, length, _ = documents[basename(file_path)]
+    with open(pack_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+# ====================
+def is_pack_file(file_name: str) -> bool:
+    """Return True if a file name is that of a pack or pack index, which
+    are not documents"""
+
+    return file_name.startswith(PACK_INDEX_FILE_NAME) \
+        or (file_name.startswith(PACK_FILE_PREFIX)
+            and PACK_FILE_EXTENSION in file_name)
+
+
+# ====================
+def document_exists(file_path: str) -> bool:
+    """Return True if a document exists as a file or a packed document"""
+
+    return isfile(file_path) \
+        or basename(file_path) in load_pack_index(dirname(file_path))[1]
+
+
+# ====================
+def get_storage_path(file_path: str) -> str:
+    """Get the path of the file a document is stored in, i.e. the pack file
+    for packed documents"""
+
+    if isfile(file_path):
+        return file_path
+    pack_path, documents = load_pack_index(dirname(file_path))
+    if basename(file_path) not in documents:
+        raise FileNotFoundError(f'No such file or packed document: '
+                                f'{file_path}')
+    return pack_path
+
+
+# ====================
+def pack_folder(folder_path: str, zstd_dict_path: str) -> int:
+    """Pack the documents in a folder into a new pack file, compressing them
+    with the zstd dictionary at zstd_dict_path, and delete the files that
+    were packed
+
+    Documents that are already packed are copied to the new pack file
+    without compressing them again. Return the number of files packed."""
+
+    old_pack_path, packed_documents = load_pack_index(folder_path)
+    with scandir(folder_path) as entries:
+        file_names = sorted(e.name for e in entries
+                            if e.is_file() and not is_pack_file(e.name))
+    if not file_names:
+        return 0
+    unpacked_names = set(file_names)
+
+    # Use a new pack file name, so that the old pack file is still valid
+    # until the new index replaces the old one
+    pack_num = 1
+    if old_pack_path:
+        pack_num = int(basename(old_pack_path)[len(PACK_FILE_PREFIX):]
+                       .split('.')[0]) + 1
+    pack_name = f'{PACK_FILE_PREFIX}{pack_num}{PACK_FILE_EXTENSION}'
+    compressor = get_zstd_compressor(zstd_dict_path, ZSTD_COMPRESSION_LEVEL)
+    index_lines = [pack_name]
+    with open(join(folder_path, pack_name), 'wb') as pack_file:
+
+        def add_document(file_name, data, text_size):
+            index_lines.append(f'{file_name}\t{pack_file.tell()}\t'
+                               f'{len(data)}\t{text_size}')
+            pack_file.write(data)
+
+        if old_pack_path:
+            with open(old_pack_path, 'rb') as old_pack_file:
+                for file_name, (offset, length, text_size) \
+                        in packed_documents.items():
+                    # Files replace packed documents with the same name
+                    if file_name not in unpacked_names:
+                        old_pack_file.seek(offset)
+                        add_document(file_name, old_pack_file.read(length),
+                                     text_size)
+        for file_name in file_names:
+            text = get_bytes_from_file(join(folder_path, file_name))
+            add_document(file_name, compressor.compress(text), len(text))
+
+    index_path = join(folder_path, PACK_INDEX_FILE_NAME)
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(index_lines) + '\n')
+    replace(index_path + '.tmp', index_path)
+    pack_indexes.pop(folder_path, None)
+    if old_pack_path:
+        remove(old_pack_path)
+    for file_name in file_names:
+        remove(join(folder_path, file_name))
+    return len(file_names)
+
+
+# ====================
+def unpack_folder(folder_path: str) -> int:
+    """Save each packed document in a folder as an uncompressed file and
+    delete the pack file and index
+
+    Return the number of documents unpacked"""
+
+    pack_path, packed_documents = load_pack_index(folder_path)
+    num_unpacked = 0
+    for file_name in packed_documents:
+        file_path = join(folder_path, file_name)
+        if isfile(file_path):
+            continue
+        # Write to a temporary file first so that an incomplete file does
+        # not replace the packed document if the program is terminated. The
+        # name of the temporary file is not taken for a document.
+        temp_path = join(folder_path, PACK_INDEX_FILE_NAME + '.unpack.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(get_bytes_from_file(file_path))
+        replace(temp_path, file_path)
+        num_unpacked += 1
+    if pack_path:
+        remove(join(folder_path, PACK_INDEX_FILE_NAME))
+        pack_indexes.pop(folder_path, None)
+        remove(pack_path)
+    return num_unpacked
+
+
 # ====================
 def get_file_paths(folder_path: str) -> list:
 
@@ -43,14 +332,64 @@ def create_blank_if_not_exist(file_path: str):
 
 # ====================
 def get_files_and_folders(path: str, full_path: bool = True) -> tuple:
+    """Get the files and folders in a folder. Packed documents are included
+    in the files, and pack files are not."""
 
+    names = listdir(path)
+    file_names = [e for e in names
+                  if isfile(join(path, e)) and not is_pack_file(e)]
+    unpacked_names = set(file_names)
+    file_names += [e for e in load_pack_index(path)[1]
+                   if e not in unpacked_names]
+    folder_names = [e for e in names if isdir(join(path, e))]
     if full_path:
-        files_and_folders = [join(path, e) for e in listdir(path)]
-        files = [e for e in files_and_folders if isfile(e)]
-        folders = [e for e in files_and_folders if isdir(e)]
+        files = [join(path, e) for e in file_names]
+        folders = [join(path, e) for e in folder_names]
     else:
-        files_and_folders = [e for e in listdir(path)]
-        files = [e for e in files_and_folders if isfile(join(path, e))]
-        folders = [e for e in files_and_folders if isdir(join(path, e))]
+        files = file_names
+        folders = folder_names
     return (files, folders)
 
+
+# ====================
+def get_file_sizes(folder_path: str) -> dict:
+    """Get the size in bytes of each document in a folder, and whether the
+    size may be that of a compressed file
+
+    Return a dictionary of file paths and tuples (size, may_be_compressed).
+    For files, both are taken from the directory listing, so no files are
+    opened. Files saved after the zstd dictionary for the folder was created
+    may be compressed, so their sizes should not be compared directly with
+    those of older files. For packed documents, the size before compressing
+    is taken from the pack index."""
+
+    try:
+        zstd_dict_mtime = stat(
+            find_zstd_dict(join(folder_path, ZSTD_DICT_FILE_NAME))).st_mtime
+    except FileNotFoundError:
+        zstd_dict_mtime = None
+    file_sizes = {}
+    with scandir(folder_path) as entries:
+        for e in entries:
+            if e.is_file() and not is_pack_file(e.name):
+                file_stat = e.stat()
+                may_be_compressed = zstd_dict_mtime is not None \
+                    and file_stat.st_mtime >= zstd_dict_mtime
+                file_sizes[join(folder_path, e.name)] = \
+                    (file_stat.st_size, may_be_compressed)
+    _, packed_documents = load_pack_index(folder_path)
+    for file_name, (_, _, text_size) in packed_documents.items():
+        file_sizes.setdefault(join(folder_path, file_name), (text_size, False))
+    return file_sizes
+
+
+# ====================
+def iter_document_paths(corpus_path: str, years: list):
+    """Yield the path of each document in the corpus, where documents are
+    stored in corpus_path/year/category"""
+
+    for year in years:
+        _, category_folders = get_files_and_folders(join(corpus_path, year))
+        for category_folder in category_folders:
+            files, _ = get_files_and_folders(category_folder)
+            yield from files
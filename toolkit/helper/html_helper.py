@@ -25,6 +25,51 @@ def get_bs(url: str) -> BeautifulSoup:
     return bs
 
 
+# ====================
+def stream_html(url: str, on_chunk, chunk_size: int = 8192) -> tuple:
+    """Get HTML from URL, passing each chunk of bytes to on_chunk as soon as
+    it arrives. Stop downloading and close the connection if on_chunk returns
+    True.
+
+    Return a tuple (html, headers, complete) where html is the bytes read,
+    headers are the response headers, and complete is False if the download
+    was stopped early"""
+
+    with request.urlopen(url) as response:
+        chunks = []
+        while True:
+            chunk = response.read1(chunk_size)
+            if not chunk:
+                return (b''.join(chunks), response.headers, True)
+            chunks.append(chunk)
+            if on_chunk(chunk):
+                return (b''.join(chunks), response.headers, False)
+
+
+# ====================
+def conditional_get(url: str, etag: str = None,
+                    last_modified: str = None) -> tuple:
+    """Get HTML from URL only if the page has changed since it was last
+    downloaded, according to the ETag and Last-Modified headers from then
+
+    Return a tuple (status, html, headers). status is 304 and html is None
+    if the page has not changed."""
+
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    try:
+        with request.urlopen(request.Request(url, headers=headers)) \
+                as response:
+            return (response.status, response.read(), response.headers)
+    except HTTPError as e:
+        if e.code == 304:
+            return (304, None, e.headers)
+        raise
+
+
 # ====================
 def get_html(url: str) -> str:
     """Get HTML from URL"""
@@ -33,6 +78,16 @@ def get_html(url: str) -> str:
     return html
 
 
+# ====================
+def get_html_and_headers(url: str) -> tuple:
+    """Get HTML and the response headers from URL
+
+    Return a tuple (html, headers)"""
+
+    with request.urlopen(url) as response:
+        return (response.read(), response.headers)
+
+
 # ====================
 def bs_from_html(html: str) -> BeautifulSoup:
     """Get BeautifulSoup object from HTML"""
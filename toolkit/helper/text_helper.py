@@ -1,5 +1,10 @@
 import fugashi
+import math
+import random
 from os import remove
+from statistics import NormalDist
+
+from helper.file_helper import get_lines_from_file, get_text_from_file
 
 tagger = fugashi.Tagger()
 
@@ -7,15 +12,20 @@ tagger = fugashi.Tagger()
 # ====================
 def jp_word_count(file_path: str) -> tuple:
 
-    with open(file_path, encoding='utf-8') as f:
-        text = f.read()
-        word_count = len(tagger(text))
+    text = get_text_from_file(file_path, errors='strict')
+    word_count = jp_text_word_count(text)
     if len(text) == 0:
         raise RuntimeError(f'Empty file encountered: {file_path}\n'
                            "Terminating program.")
     return word_count
 
 
+# ====================
+def jp_text_word_count(text: str) -> int:
+
+    return len(tagger(text))
+
+
 # ====================
 def sum_of_jp_word_counts(files: str):
 
@@ -23,6 +33,75 @@ def sum_of_jp_word_counts(files: str):
     return(sum(word_counts))
 
 
+# ====================
+def estimate_jp_word_count(file_sizes: dict, sample_size: int = 50,
+                           confidence: float = 0.95) -> tuple:
+    """Estimate the total number of words in a set of files by counting the
+    words in a random sample of the files and applying the ratio of words to
+    bytes in the sample to the total size of all the files
+
+    file_sizes is a dictionary of file paths and tuples
+    (size, may_be_compressed), as returned by get_file_sizes in
+    helper/file_helper.py. Compressed files have many more words per byte
+    than uncompressed files, so files that may be compressed are estimated
+    separately from the rest, with the sample split between them in
+    proportion to their numbers of files (and at least two files from
+    each).
+
+    Return a tuple (estimate, margin) where the total number of words is
+    within estimate ± margin with the confidence specified. If there are no
+    more files than the sample size, all files are counted and the margin is
+    zero."""
+
+    if sample_size < 2:
+        raise ValueError('The sample size must be at least 2 to estimate the '
+                         f'margin of error, but {sample_size} was given.')
+    groups = {}
+    for file, (size, may_be_compressed) in file_sizes.items():
+        groups.setdefault(may_be_compressed, {})[file] = size
+    estimate = 0.0
+    variance = 0.0
+    for group_sizes in groups.values():
+        group_sample_size = max(
+            2, round(sample_size * len(group_sizes) / len(file_sizes)))
+        group_estimate, group_variance = \
+            ratio_estimate_jp_word_count(group_sizes, group_sample_size)
+        estimate += group_estimate
+        variance += group_variance
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    margin = z * math.sqrt(variance)
+    return (round(estimate), round(margin))
+
+
+# ====================
+def ratio_estimate_jp_word_count(file_sizes: dict, sample_size: int) -> tuple:
+    """Estimate the total number of words in a set of files from a sample,
+    using the ratio of words to bytes in the sample
+
+    file_sizes is a dictionary of file paths and their sizes in bytes.
+
+    Return a tuple (estimate, variance)"""
+
+    files = list(file_sizes.keys())
+    if len(files) <= sample_size:
+        return (sum_of_jp_word_counts(files), 0.0)
+
+    sample = random.sample(files, sample_size)
+    sample_words = [jp_word_count(f) for f in sample]
+    sample_bytes = [file_sizes[f] for f in sample]
+    words_per_byte = sum(sample_words) / sum(sample_bytes)
+    estimate = words_per_byte * sum(file_sizes.values())
+
+    # Variance of the ratio estimator of the total
+    residuals = [w - words_per_byte * b
+                 for w, b in zip(sample_words, sample_bytes)]
+    residual_variance = sum(r ** 2 for r in residuals) / (sample_size - 1)
+    finite_population_correction = 1 - sample_size / len(files)
+    variance = len(files) ** 2 * finite_population_correction \
+        * residual_variance / sample_size
+    return (estimate, variance)
+
+
 # ====================
 def word_tokenize_line(jp_text: str):
 
@@ -33,7 +112,6 @@ def word_tokenize_line(jp_text: str):
 # ====================
 def word_tokenize_file(input_path: str, output_path: str):
 
-    with open(input_path, encoding='utf-8') as in_file, \
-         open(output_path, "a", encoding='utf-8') as out_file:
-        for line in in_file:
+    with open(output_path, "a", encoding='utf-8') as out_file:
+        for line in get_lines_from_file(input_path, errors='strict'):
             out_file.write("\n" + word_tokenize_line(line))
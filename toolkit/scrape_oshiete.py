@@ -14,23 +14,90 @@ an argument.
 E.g.
 > python scrape.oshiete.py 2001
 
+Add --stream to scan pages as they are downloaded and stop downloading pages
+as soon as it is certain they have no content from the year specified (see
+get_oshiete_article.py). The bytes and CPU time saved are reported for each
+page skipped.
+
+Alternatively, run the program with --balanced instead of a year to scrape
+all the years in the progress JSON in balanced mode. The ID range for each
+year is split into sub-ranges of SUB_RANGE_SIZE IDs, and before each
+sub-range the year where the next requests are expected to add the most
+words to the balanced corpus compiled by corpus-compiler.py is chosen (see
+balanced_scheduler.py). Sub-ranges for each year are scraped in order.
+
+E.g.
+> python scrape.oshiete.py --balanced
+
+Add --pipeline to scrape a year using a pipeline of separate stages, so that
+pages can be downloaded and parsed concurrently:
+
+fetch queue -> fetcher threads -> parse queue -> parser processes
+-> write queue -> writer
+
+Fetcher threads download pages (--fetchers), a pool of worker processes
+parses them with PageResult (--parsers), and the main thread saves the
+results and updates the log. Parsing is CPU-bound, so it is done in separate
+processes to use more than one core. All queues are bounded (--queue-size),
+so a slow stage makes the stages before it wait instead of using more and
+more memory. The depth of each queue is printed every
+METRICS_INTERVAL seconds, and the mean and maximum depths are printed at the
+end, to show which stage is the bottleneck.
+
+E.g.
+> python scrape.oshiete.py 2021 --pipeline --fetchers 16 --parsers 4
+
+Run with --refresh to check pages that are already in the corpus for
+answers added since they were scraped, optionally for a single year. When a
+page is saved, its ETag and Last-Modified headers and a hash of the times of
+its questions and answers are added to REFRESH_INFO_PATH (one JSON object per
+line, where later lines for a URL replace earlier ones). Pages are refreshed
+with conditional GETs using the headers, so unchanged pages are not
+downloaded again if the server supports them. Otherwise, the times of the
+questions and answers on the page are compared with the hash, and content is
+only extracted again from pages where they have changed. Updated text and
+word counts are saved in place, i.e. to the same file and log row. The log is
+saved every REFRESH_SAVE_INTERVAL updated pages. Pages scraped before headers
+were saved are always extracted again the first time they are refreshed.
+
+E.g.
+> python scrape.oshiete.py 2001 --refresh
+
 The program can be terminated at any time by pressing Ctrl+C and will
 save its progress by updating the value of 'continue_from' for the year
 it was scraping for in the progress JSON.
+
+Each row of the log has the format:
+file_name,url,category,year,word_count
 """
 
 import argparse
 import csv
 import json
 import os
-
-from get_oshiete_article import PageResult
-from helper.file_helper import (create_blank_if_not_exist, save_text_to_file,
-                                write_line_to_file)
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from balanced_scheduler import BalancedScheduler
+from get_oshiete_article import PageResult, get_refresh_info
+from helper.file_helper import (ZSTD_DICT_FILE_NAME,
+                                ZSTD_FAST_COMPRESSION_LEVEL,
+                                create_blank_if_not_exist, document_exists,
+                                get_text_from_file, is_compressed_file,
+                                save_text_to_file, write_line_to_file)
+from helper.html_helper import conditional_get, get_html_and_headers
+from helper.text_helper import jp_text_word_count
 
 CORPUS_PATH = "E:/oshiete_corpus/"
 LOG_FILE_PATH = os.path.join(CORPUS_PATH, "log.csv")
 PROGRESS_JSON_PATH = 'progress.json'
+ZSTD_DICT_PATH = os.path.join(CORPUS_PATH, ZSTD_DICT_FILE_NAME)
+REFRESH_INFO_PATH = os.path.join(CORPUS_PATH, "refresh_info.jsonl")
+SUB_RANGE_SIZE = 200
+METRICS_INTERVAL = 10
+# Number of pages updated by a refresh between saves of the log
+REFRESH_SAVE_INTERVAL = 100
 
 
 # ====================
@@ -42,7 +109,36 @@ def get_args():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('year',
                         metavar='year',
+                        nargs='?',
                         help='The year to scrape content from')
+    parser.add_argument('--balanced',
+                        action='store_true',
+                        help='Scrape all years, choosing which year to '
+                             'scrape next to keep the corpus balanced')
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='Stop downloading pages early when they have no '
+                             'content from the year specified')
+    parser.add_argument('--pipeline',
+                        action='store_true',
+                        help='Download and parse pages concurrently')
+    parser.add_argument('--fetchers',
+                        type=int,
+                        default=8,
+                        help='Number of fetcher threads in pipeline mode')
+    parser.add_argument('--parsers',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='Number of parser processes in pipeline mode')
+    parser.add_argument('--refresh',
+                        action='store_true',
+                        help='Update pages already in the corpus with '
+                             'answers added since they were scraped')
+    parser.add_argument('--queue-size',
+                        type=int,
+                        default=32,
+                        help='Maximum number of pages in each queue in '
+                             'pipeline mode')
     return parser.parse_args()
 
 
@@ -80,6 +176,13 @@ def read_log(log_path: str):
     return (files, urls)
 
 
+# ====================
+def read_log_rows(log_path: str) -> list:
+
+    with open(log_path, encoding='utf-8') as csv_file:
+        return list(csv.reader(csv_file, delimiter=','))
+
+
 # ====================
 def get_next_file_num(existing_files):
 
@@ -90,7 +193,7 @@ def get_next_file_num(existing_files):
 
 
 # ====================
-def get_articles(year: int):
+def get_articles(year: int, streaming: bool = False):
 
     create_blank_if_not_exist(LOG_FILE_PATH)
     existing_files, existing_urls = read_log(LOG_FILE_PATH)
@@ -99,6 +202,8 @@ def get_articles(year: int):
     progress = load_progress()
     start_id = progress[str(year)]["continue_from"]
     end_id = progress[str(year)]["end"]
+    bytes_saved = 0
+    cpu_saved = 0.0
 
     try:
         for id in range(start_id, end_id):
@@ -108,22 +213,17 @@ def get_articles(year: int):
                 print(f"{url}\tAlready in corpus.")
                 continue
 
-            result = PageResult(url, year)
+            result = PageResult(url, year, streaming)
+            # Pages parsed in full have bytes_saved of zero and negative
+            # cpu_saved, for the time spent scanning them
+            bytes_saved += getattr(result, 'bytes_saved', 0)
+            cpu_saved += getattr(result, 'cpu_saved', None) or 0.0
             if not result.success:
                 print(f"{url}\t{result.err_msg}")
                 continue
 
-            # Save the new file to the corpus
-            file_name = f"{next_file_num}.txt"
-            file_path = os.path.join(
-                CORPUS_PATH, str(year), result.category, file_name
-            )
-            save_text_to_file(result.text, file_path)
+            save_article(result, url, year, next_file_num)
             next_file_num += 1
-            # Update the log
-            log = f"{file_name},{url},{result.category},{year}"
-            write_line_to_file(log, LOG_FILE_PATH)
-            print(f"{url}\t{file_name}")
 
     except KeyboardInterrupt:
         print(f"You terminated the program while processing id: {id}.")
@@ -139,17 +239,452 @@ def get_articles(year: int):
         print("Progress file has been updated")
 
     print()
+    if streaming:
+        if cpu_saved >= 0:
+            cpu_info = f"saved {cpu_saved:.1f} seconds of CPU time"
+        else:
+            cpu_info = f"cost {-cpu_saved:.1f} seconds of extra CPU time"
+        print(f"Streaming saved {bytes_saved / 1_000_000:.1f} MB of downloads",
+              f"and {cpu_info}.")
+    print("Finished.")
+
+
+# ====================
+def get_articles_balanced(streaming: bool = False):
+
+    create_blank_if_not_exist(LOG_FILE_PATH)
+    log_rows = read_log_rows(LOG_FILE_PATH)
+    existing_urls = set(row[1] for row in log_rows)
+    next_file_num = get_next_file_num([row[0] for row in log_rows])
+
+    progress = load_progress()
+    years = list(progress.keys())
+    print("Getting word counts from the log...")
+    try:
+        scheduler = BalancedScheduler(years, log_rows, CORPUS_PATH)
+    except KeyboardInterrupt:
+        print("You terminated the program while getting word counts.",
+              "The word counts so far have been saved.")
+        return
+    id = None
+
+    try:
+        while True:
+            year = scheduler.choose_year(
+                [y for y in years
+                 if progress[y]["continue_from"] < progress[y]["end"]])
+            if year is None:
+                break
+            start_id = progress[year]["continue_from"]
+            end_id = min(start_id + SUB_RANGE_SIZE, progress[year]["end"])
+            print(f"Scraping {year} IDs {start_id}-{end_id - 1}.",
+                  f"Balanced corpus: {scheduler.balanced_word_count()} words.",
+                  "Expected usable words per request:",
+                  f"{scheduler.expected_usable_words(year):.1f}")
+
+            for id in range(start_id, end_id):
+
+                # Keep progress up to date in case the program is terminated
+                progress[year]["continue_from"] = id
+                url = make_url(id)
+                if url in existing_urls:
+                    print(f"{url}\tAlready in corpus.")
+                    continue
+
+                result = PageResult(url, int(year), streaming)
+                scheduler.add_request(year, result.success)
+                if not result.success:
+                    print(f"{url}\t{result.err_msg}")
+                    continue
+
+                log_row = save_article(result, url, year, next_file_num)
+                next_file_num += 1
+                existing_urls.add(url)
+                scheduler.add_page(year, result.category, int(log_row[4]))
+
+            progress[year]["continue_from"] = end_id
+            save_progress(progress)
+
+    except KeyboardInterrupt:
+        print(f"You terminated the program while processing id: {id}.")
+        save_progress(progress)
+        print("Progress file has been updated")
+
+    except Exception as e:
+        print(f"The program terminated due to a <<<{e}>>> error",
+              f"while processing id: {id}.")
+        save_progress(progress)
+        print("Progress file has been updated")
+
+    print()
+    print("Finished.")
+
+
+# ====================
+def get_articles_pipeline(year: int, num_fetchers: int = 8,
+                          num_parsers: int = None, queue_size: int = 32):
+
+    create_blank_if_not_exist(LOG_FILE_PATH)
+    existing_files, existing_urls = read_log(LOG_FILE_PATH)
+    existing_urls = set(existing_urls)
+    next_file_num = get_next_file_num(existing_files)
+
+    progress = load_progress()
+    start_id = progress[str(year)]["continue_from"]
+    end_id = progress[str(year)]["end"]
+
+    # Items in each queue are tuples (id, url, ...). None is passed down
+    # the pipeline to tell each stage that there are no more items.
+    fetch_queue = queue.Queue(maxsize=queue_size)
+    parse_queue = queue.Queue(maxsize=queue_size)
+    # Futures for pages being parsed, in the order they were submitted
+    parsing_queue = queue.Queue(maxsize=num_parsers or os.cpu_count())
+    write_queue = queue.Queue(maxsize=queue_size)
+    queues = {'fetch': fetch_queue, 'parse': parse_queue,
+              'parsing': parsing_queue, 'write': write_queue}
+    parser_pool = ProcessPoolExecutor(num_parsers)
+
+    def feed():
+        for id in range(start_id, end_id):
+            url = make_url(id)
+            if url in existing_urls:
+                write_queue.put((id, url, None, "Already in corpus."))
+            else:
+                fetch_queue.put((id, url))
+        for _ in range(num_fetchers):
+            fetch_queue.put(None)
+
+    def fetch():
+        while True:
+            item = fetch_queue.get()
+            if item is None:
+                break
+            id, url = item
+            try:
+                html, headers = get_html_and_headers(url)
+                parse_queue.put((id, url, html, dict(headers)))
+            except Exception as e:
+                write_queue.put(
+                    (id, url, None, f'<<<{e}>>> error while getting HTML.'))
+        parse_queue.put(None)
+
+    def dispatch():
+        fetchers_finished = 0
+        while fetchers_finished < num_fetchers:
+            item = parse_queue.get()
+            if item is None:
+                fetchers_finished += 1
+                continue
+            id, url, html, headers = item
+            parsing_queue.put(
+                (id, url, parser_pool.submit(PageResult, url, year,
+                                             html=html, headers=headers)))
+        parsing_queue.put(None)
+
+    def collect():
+        while True:
+            item = parsing_queue.get()
+            if item is None:
+                break
+            id, url, future = item
+            try:
+                result = future.result()
+                err_msg = None if result.success else result.err_msg
+            except Exception as e:
+                result = None
+                err_msg = f"<<<{e}>>> error while parsing!"
+            write_queue.put((id, url, result, err_msg))
+        write_queue.put(None)
+
+    stop_metrics = threading.Event()
+    metrics = {name: [] for name in queues}
+
+    def monitor():
+        last_id = start_id
+        while not stop_metrics.wait(METRICS_INTERVAL):
+            depths = {name: q.qsize() for name, q in queues.items()}
+            for name, depth in depths.items():
+                metrics[name].append(depth)
+            ids_per_second = (next_id - last_id) / METRICS_INTERVAL
+            last_id = next_id
+            print('Queue depths:',
+                  ', '.join(f'{name} {depth}'
+                            for name, depth in depths.items()),
+                  f'({ids_per_second:.1f} IDs/s)')
+
+    # Completed IDs that have not yet been added to the progress because
+    # earlier IDs are still being processed
+    completed_ids = set()
+    next_id = start_id
+    threads = [threading.Thread(target=feed),
+               threading.Thread(target=dispatch),
+               threading.Thread(target=collect),
+               threading.Thread(target=monitor)] \
+        + [threading.Thread(target=fetch) for _ in range(num_fetchers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        while True:
+            # Wait with a timeout so that Ctrl+C is not blocked on Windows
+            try:
+                item = write_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            id, url, result, err_msg = item
+            if err_msg:
+                print(f"{url}\t{err_msg}")
+            else:
+                save_article(result, url, year, next_file_num)
+                next_file_num += 1
+            completed_ids.add(id)
+            while next_id in completed_ids:
+                completed_ids.remove(next_id)
+                next_id += 1
+        progress[str(year)]['continue_from'] = end_id
+        save_progress(progress)
+
+    except KeyboardInterrupt:
+        print("You terminated the program while processing ids",
+              f"from {next_id}.")
+        progress[str(year)]['continue_from'] = next_id
+        save_progress(progress)
+        print("Progress file has been updated")
+
+    except Exception as e:
+        print(f"The program terminated due to a <<<{e}>>> error",
+              f"while processing ids from {next_id}.")
+        progress[str(year)]['continue_from'] = next_id
+        save_progress(progress)
+        print("Progress file has been updated")
+
+    stop_metrics.set()
+    parser_pool.shutdown(wait=False, cancel_futures=True)
+    print()
+    for name, depths in metrics.items():
+        if depths:
+            print(f"{name} queue depth: mean {sum(depths) / len(depths):.1f},",
+                  f"max {max(depths)} (limit {queues[name].maxsize})")
     print("Finished.")
 
 
+# ====================
+def refresh_articles(year: int = None):
+
+    create_blank_if_not_exist(LOG_FILE_PATH)
+    log_rows = read_log_rows(LOG_FILE_PATH)
+    refresh_info = load_refresh_info()
+    # Refresh info for updated pages is only saved after the log, so that a
+    # page is not skipped next time if the program is terminated before its
+    # new word count is saved
+    unsaved_refresh_info = {}
+    num_checked = 0
+    num_updated = 0
+    url = None
+
+    try:
+        for row in log_rows:
+
+            file_name, url, category, row_year = row[:4]
+            if year is not None and row_year != str(year):
+                continue
+            file_path = os.path.join(CORPUS_PATH, row_year, category,
+                                     file_name)
+            if not document_exists(file_path):
+                print(f"{url}\t{file_name} not found.")
+                continue
+            num_checked += 1
+            previous_info = refresh_info.get(url, {})
+            try:
+                status, html, headers = conditional_get(
+                    url, previous_info.get('etag'),
+                    previous_info.get('last_modified'))
+            except Exception as e:
+                print(f"{url}\t<<<{e}>>> error while getting HTML.")
+                continue
+            if status == 304:
+                print(f"{url}\tNot modified.")
+                continue
+
+            try:
+                # Compare the times of the questions and answers on the page
+                # with the last time it was downloaded
+                info = get_refresh_info(html, headers, int(row_year))
+                updated = False
+                if previous_info.get('fingerprint') == info['fingerprint']:
+                    message = "No new answers."
+                else:
+                    result = PageResult(url, int(row_year), html=html)
+                    if not result.success:
+                        message = result.err_msg
+                    else:
+                        message = update_article(result, row, file_path)
+                        updated = message is not None
+                        if updated:
+                            num_updated += 1
+                        else:
+                            message = "No new content."
+            except Exception as e:
+                print(f"{url}\t<<<{e}>>> error while refreshing {file_name}.")
+                continue
+            refresh_info[url] = info
+            if updated or url in unsaved_refresh_info:
+                unsaved_refresh_info[url] = info
+            else:
+                save_refresh_info(url, info)
+            print(f"{url}\t{message}")
+
+            if len(unsaved_refresh_info) >= REFRESH_SAVE_INTERVAL:
+                save_log_rows(log_rows)
+                for unsaved_url, unsaved_info in unsaved_refresh_info.items():
+                    save_refresh_info(unsaved_url, unsaved_info)
+                unsaved_refresh_info = {}
+
+    except KeyboardInterrupt:
+        print(f"You terminated the program while refreshing {url}.")
+
+    except Exception as e:
+        print(f"The program terminated due to a <<<{e}>>> error",
+              f"while refreshing {url}.")
+
+    if unsaved_refresh_info:
+        save_log_rows(log_rows)
+        for unsaved_url, unsaved_info in unsaved_refresh_info.items():
+            save_refresh_info(unsaved_url, unsaved_info)
+    compact_refresh_info(refresh_info)
+    print()
+    print(f"Checked {num_checked} pages and updated {num_updated}.")
+    print("Finished.")
+
+
+# ====================
+def update_article(result: PageResult, row: list, file_path: str) -> str:
+    """Update the saved text and the word count in the log row for a page
+    that has been scraped again, if either has changed
+
+    Return a message describing the update, or None if nothing changed"""
+
+    word_count = str(jp_text_word_count(result.text))
+    if result.text != get_text_from_file(file_path):
+        zstd_dict_path = ZSTD_DICT_PATH \
+            if is_compressed_file(file_path) else None
+        save_text_to_file(result.text, file_path, zstd_dict_path,
+                          ZSTD_FAST_COMPRESSION_LEVEL)
+        row[4:] = [word_count]
+        return f"{row[0]} updated."
+    # The word count is out of date if a previous refresh was terminated
+    # after saving the text but before saving the log
+    if row[4:] != [word_count]:
+        row[4:] = [word_count]
+        return "Word count updated."
+    return None
+
+
+# ====================
+def save_log_rows(log_rows: list):
+    """Save the whole log, e.g. after updating word counts"""
+
+    # Write to a temporary file first so that the log is not lost if the
+    # program is terminated
+    temp_log_path = LOG_FILE_PATH + '.tmp'
+    save_text_to_file(''.join(f"{','.join(row)}\n" for row in log_rows),
+                      temp_log_path)
+    os.replace(temp_log_path, LOG_FILE_PATH)
+
+
+# ====================
+def load_refresh_info() -> dict:
+    """Get the refresh info saved for each URL, where later lines of the
+    refresh info file replace earlier ones"""
+
+    refresh_info = {}
+    if os.path.isfile(REFRESH_INFO_PATH):
+        with open(REFRESH_INFO_PATH, encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    info = json.loads(line)
+                    refresh_info[info.pop('url')] = info
+    return refresh_info
+
+
+# ====================
+def save_refresh_info(url: str, info: dict):
+    """Add the refresh info for a page to the end of the refresh info
+    file"""
+
+    write_line_to_file(json.dumps({'url': url, **info}), REFRESH_INFO_PATH)
+
+
+# ====================
+def compact_refresh_info(refresh_info: dict):
+    """Rewrite the refresh info file with one line for each URL"""
+
+    temp_path = REFRESH_INFO_PATH + '.tmp'
+    save_text_to_file(''.join(f"{json.dumps({'url': url, **info})}\n"
+                              for url, info in refresh_info.items()),
+                      temp_path)
+    os.replace(temp_path, REFRESH_INFO_PATH)
+
+
+# ====================
+def save_article(result: PageResult, url: str, year: int,
+                 file_num: int) -> list:
+    """Save the text of a page to the corpus and add it to the log. The text
+    is compressed if a dictionary has been trained with compress_corpus.py.
+    The headers and fingerprint of the page are saved for refreshing.
+
+    Return the row added to the log"""
+
+    file_name = f"{file_num}.txt"
+    file_path = os.path.join(
+        CORPUS_PATH, str(year), result.category, file_name
+    )
+    zstd_dict_path = ZSTD_DICT_PATH if os.path.isfile(ZSTD_DICT_PATH) \
+        else None
+    save_text_to_file(result.text, file_path, zstd_dict_path,
+                      ZSTD_FAST_COMPRESSION_LEVEL)
+    word_count = jp_text_word_count(result.text)
+    log_row = [file_name, url, result.category, str(year), str(word_count)]
+    write_line_to_file(','.join(log_row), LOG_FILE_PATH)
+    if getattr(result, 'refresh_info', None):
+        save_refresh_info(url, result.refresh_info)
+    print(f"{url}\t{file_name}")
+    return log_row
+
+
 # ====================
 def main():
 
     args = get_args()
+    if args.stream and args.pipeline:
+        print("--stream cannot be used with --pipeline.")
+        return
+    if args.balanced and args.pipeline:
+        print("--balanced cannot be used with --pipeline.")
+        return
+    if args.refresh and (args.balanced or args.pipeline or args.stream):
+        print("--refresh cannot be used with --balanced, --pipeline or",
+              "--stream.")
+        return
+    if args.refresh:
+        refresh_articles(None if args.year is None else int(args.year))
+        return
+    if args.balanced:
+        get_articles_balanced(args.stream)
+        return
+    if args.year is None:
+        print("Please specify a year or use --balanced.")
+        return
     year = int(args.year)
     progress = load_progress()
-    if str(year) in progress:
-        get_articles(year)
+    if str(year) in progress and args.pipeline:
+        get_articles_pipeline(year, args.fetchers, args.parsers,
+                              args.queue_size)
+    elif str(year) in progress:
+        get_articles(year, args.stream)
     else:
         print("No settings information available for that year.",
               "Please add settings information or choose from one of the",